@@ -1,8 +1,12 @@
 import cv2
 import numpy as np
 import os
+import json
+import hashlib
+import time
 import subprocess
 import open3d as o3d
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import shutil
 
@@ -35,99 +39,322 @@ class VideoTo3DMesh:
         for dir_path in [self.frames_dir, self.colmap_dir, self.sparse_dir, self.dense_dir]:
             dir_path.mkdir(parents=True, exist_ok=True)
 
-    def extract_frames(self):
-        """Extract frames from video between start_frame and end_frame"""
+    def extract_frames(self, stride=1, keyframes_only=False, keyframe_threshold=12.0, num_writers=4):
+        """
+        Extract frames from video between start_frame and end_frame
+        
+        Args:
+            stride (int): Keep every `stride`-th frame; skipped frames are grabbed but not decoded to images
+            keyframes_only (bool): Keep only frames whose content changed noticeably since the last kept frame
+            keyframe_threshold (float): Mean absolute difference (0-255) on a 64x64 thumbnail that makes a keyframe
+            num_writers (int): Threads encoding JPEGs while the next frames are decoded
+            
+        Returns:
+            int: Number of frames saved
+        """
         cap = cv2.VideoCapture(self.video_path)
-        frame_count = 0
+        
+        # Seek straight to start_frame instead of decoding everything before it
+        if self.start_frame > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+        frame_count = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+        
+        # Backends that cannot seek (or report a different position) are
+        # reopened at frame 0 and skipped forward cheaply with grab()
+        if frame_count != self.start_frame:
+            cap.release()
+            cap = cv2.VideoCapture(self.video_path)
+            frame_count = 0
+            while frame_count < self.start_frame and cap.grab():
+                frame_count += 1
+        
         saved_count = 0
+        last_thumbnail = None
+        pending = []
         
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
+        with ThreadPoolExecutor(max_workers=num_writers) as writers:
+            while cap.isOpened() and frame_count <= self.end_frame:
+                if (frame_count - self.start_frame) % stride != 0:
+                    if not cap.grab():
+                        break
+                    frame_count += 1
+                    continue
+                
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frame_count += 1
+                
+                if keyframes_only:
+                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    thumbnail = cv2.resize(gray, (64, 64), interpolation=cv2.INTER_AREA).astype(np.float32)
+                    if last_thumbnail is not None and np.abs(thumbnail - last_thumbnail).mean() < keyframe_threshold:
+                        continue
+                    last_thumbnail = thumbnail
                 
-            if self.start_frame <= frame_count <= self.end_frame:
                 output_path = self.frames_dir / f"frame_{saved_count:06d}.jpg"
-                cv2.imwrite(str(output_path), frame)
+                pending.append(writers.submit(cv2.imwrite, str(output_path), frame))
                 saved_count += 1
                 
-            frame_count += 1
-            if frame_count > self.end_frame:
-                break
+                # Bound the number of decoded frames waiting to be written
+                if len(pending) >= 4 * num_writers:
+                    pending.pop(0).result()
+            
+            for future in pending:
+                future.result()
                 
         cap.release()
+        
+        # Frames beyond this run's count are left over from an earlier run with
+        # other stride/keyframe/range settings; COLMAP must not see them
+        for stale in self.frames_dir.glob("frame_*.jpg"):
+            index = stale.stem[len("frame_"):]
+            if index.isdigit() and int(index) >= saved_count:
+                stale.unlink()
         return saved_count
 
-    def run_colmap(self):
-        """Run COLMAP pipeline for 3D reconstruction"""
-        # Feature extraction
-        subprocess.run([
-            "colmap", "feature_extractor",
-            "--database_path", str(self.colmap_dir / "database.db"),
-            "--image_path", str(self.frames_dir),
-            "--ImageReader.single_camera", "1"
-        ])
-
-        # Feature matching
-        subprocess.run([
-            "colmap", "exhaustive_matcher",
-            "--database_path", str(self.colmap_dir / "database.db")
-        ])
-
-        # Sparse reconstruction
-        subprocess.run([
-            "colmap", "mapper",
-            "--database_path", str(self.colmap_dir / "database.db"),
-            "--image_path", str(self.frames_dir),
-            "--output_path", str(self.sparse_dir)
-        ])
-
-        # Dense reconstruction
-        subprocess.run([
-            "colmap", "image_undistorter",
-            "--image_path", str(self.frames_dir),
-            "--input_path", str(self.sparse_dir / "0"),
-            "--output_path", str(self.dense_dir),
-            "--output_type", "COLMAP"
-        ])
-
-        subprocess.run([
-            "colmap", "patch_match_stereo",
-            "--workspace_path", str(self.dense_dir)
-        ])
-
-        subprocess.run([
-            "colmap", "stereo_fusion",
-            "--workspace_path", str(self.dense_dir),
-            "--output_path", str(self.dense_dir / "fused.ply")
-        ])
-
-    def create_mesh(self):
-        """Create mesh from point cloud using Open3D"""
+    def _load_manifest(self):
+        """Load the COLMAP stage checkpoint manifest"""
+        manifest_path = self.colmap_dir / "stages.json"
+        if manifest_path.exists():
+            with open(manifest_path) as f:
+                return json.load(f)
+        return {}
+
+    def _save_manifest(self, manifest):
+        with open(self.colmap_dir / "stages.json", "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def _run_stage(self, manifest, name, command, outputs, inputs=None, force=False, clean=()):
+        """
+        Run one COLMAP stage unless the manifest marks it complete with the same command
+        
+        Args:
+            manifest (dict): Stage manifest, updated and saved in place
+            name (str): Stage name used as the manifest key
+            command (list): COLMAP command line
+            outputs (list): Paths the stage must leave behind to count as complete
+            inputs (str): Optional fingerprint of the stage inputs; a change forces a rerun
+            force (bool): Rerun even if checkpointed (set when an earlier stage reran)
+            clean (list): Paths deleted before the stage runs; the entries of all other
+                stages are then dropped from the manifest
+            
+        Returns:
+            bool: True if the stage ran, False if it was skipped
+        """
+        entry = manifest.get(name, {})
+        if (not force and entry.get("status") == "done" and entry.get("command") == command
+                and entry.get("inputs") == inputs and all(Path(p).exists() for p in outputs)):
+            print(f"Skipping COLMAP {name} (checkpointed)")
+            return False
+
+        if clean:
+            for path in map(Path, clean):
+                if path.is_dir():
+                    shutil.rmtree(path)
+                    path.mkdir(parents=True)
+                elif path.exists():
+                    path.unlink()
+            for stage in list(manifest):
+                if stage != name:
+                    del manifest[stage]
+            self._save_manifest(manifest)
+
+        print(f"Running COLMAP {name}...")
+        start = time.time()
+        result = subprocess.run(command)
+        elapsed = time.time() - start
+
+        manifest[name] = {
+            "status": "done" if result.returncode == 0 else "failed",
+            "command": command,
+            "inputs": inputs,
+            "returncode": result.returncode,
+            "seconds": round(elapsed, 2)
+        }
+        self._save_manifest(manifest)
+
+        if result.returncode != 0:
+            raise RuntimeError(f"COLMAP {name} failed with exit code {result.returncode}")
+        return True
+
+    def _matcher_command(self, matcher, vocab_tree_path, overlap):
+        """Build the feature matching command for the chosen strategy"""
+        database = str(self.colmap_dir / "database.db")
+        if matcher == "exhaustive":
+            return ["colmap", "exhaustive_matcher", "--database_path", database]
+        if matcher == "sequential":
+            command = [
+                "colmap", "sequential_matcher",
+                "--database_path", database,
+                "--SequentialMatching.overlap", str(overlap)
+            ]
+            if vocab_tree_path:
+                # Loop detection catches revisited places, e.g. a walk around a building
+                command += [
+                    "--SequentialMatching.loop_detection", "1",
+                    "--SequentialMatching.vocab_tree_path", str(vocab_tree_path)
+                ]
+            return command
+        if matcher == "vocab_tree":
+            if not vocab_tree_path:
+                raise ValueError("vocab_tree matching requires vocab_tree_path")
+            return [
+                "colmap", "vocab_tree_matcher",
+                "--database_path", database,
+                "--VocabTreeMatching.vocab_tree_path", str(vocab_tree_path)
+            ]
+        raise ValueError(f"Unknown matcher strategy: {matcher}")
+
+    def run_colmap(self, matcher="auto", vocab_tree_path=None, overlap=10, exhaustive_limit=100):
+        """
+        Run COLMAP pipeline for 3D reconstruction
+        
+        Completed stages are recorded in colmap/stages.json with their command
+        line and wall time, and skipped on rerun; once a stage reruns, every
+        later stage reruns too. A failing stage stops the pipeline.
+        
+        Args:
+            matcher (str): "auto", "exhaustive", "sequential" or "vocab_tree"; "auto" uses
+                exhaustive matching up to `exhaustive_limit` frames and sequential matching beyond
+            vocab_tree_path (str): COLMAP vocabulary tree, enables loop detection for sequential matching
+            overlap (int): Number of neighbouring frames each frame is matched against sequentially
+            exhaustive_limit (int): Frame count up to which "auto" picks exhaustive matching
+        """
+        frames = sorted(self.frames_dir.glob("*.jpg"))
+        # Changed frames invalidate the features even if the command is unchanged.
+        # extract_frames rewrites every JPEG, so hash content rather than mtimes:
+        # re-extracting the same frames keeps the checkpoints valid
+        digest = hashlib.sha1()
+        for frame in frames:
+            digest.update(frame.name.encode())
+            digest.update(frame.read_bytes())
+        frames_fingerprint = f"{len(frames)}:{digest.hexdigest()}"
+        if matcher == "auto":
+            matcher = "exhaustive" if len(frames) <= exhaustive_limit else "sequential"
+
+        database = str(self.colmap_dir / "database.db")
+        manifest = self._load_manifest()
+        stages = [
+            ("features", [
+                "colmap", "feature_extractor",
+                "--database_path", database,
+                "--image_path", str(self.frames_dir),
+                "--ImageReader.single_camera", "1"
+            ], [database]),
+            ("matches", self._matcher_command(matcher, vocab_tree_path, overlap), [database]),
+            ("sparse", [
+                "colmap", "mapper",
+                "--database_path", database,
+                "--image_path", str(self.frames_dir),
+                "--output_path", str(self.sparse_dir)
+            ], [self.sparse_dir / "0"]),
+            ("undistort", [
+                "colmap", "image_undistorter",
+                "--image_path", str(self.frames_dir),
+                "--input_path", str(self.sparse_dir / "0"),
+                "--output_path", str(self.dense_dir),
+                "--output_type", "COLMAP"
+            ], [self.dense_dir / "images"]),
+            ("stereo", [
+                "colmap", "patch_match_stereo",
+                "--workspace_path", str(self.dense_dir)
+            ], [self.dense_dir / "stereo"]),
+            ("fusion", [
+                "colmap", "stereo_fusion",
+                "--workspace_path", str(self.dense_dir),
+                "--output_path", str(self.dense_dir / "fused.ply")
+            ], [self.dense_dir / "fused.ply"])
+        ]
+
+        rerun = False
+        for name, command, outputs in stages:
+            inputs = frames_fingerprint if name == "features" else None
+            # feature_extractor skips frame names already in the database, so
+            # re-extracting starts from an empty database and drops later outputs
+            clean = [database, self.sparse_dir, self.dense_dir] if name == "features" else ()
+            rerun = self._run_stage(manifest, name, command, outputs, inputs=inputs, force=rerun,
+                                    clean=clean) or rerun
+
+    def _choose_voxel_size(self, pcd, target_points):
+        """Grow the voxel size until downsampling leaves at most target_points points"""
+        extent = np.linalg.norm(pcd.get_max_bound() - pcd.get_min_bound())
+        voxel_size = extent / 2000.0
+        downsampled = pcd.voxel_down_sample(voxel_size)
+        while len(downsampled.points) > target_points:
+            voxel_size *= 1.5
+            downsampled = pcd.voxel_down_sample(voxel_size)
+        return voxel_size, downsampled
+
+    @staticmethod
+    def _poisson_depth(num_points, min_depth=8, max_depth=11):
+        """Octree depth for Poisson reconstruction; a surface with 4**depth cells suits num_points"""
+        depth = int(round(np.log(max(num_points, 1)) / np.log(4)))
+        return int(np.clip(depth, min_depth, max_depth))
+
+    def create_mesh(self, voxel_size=None, target_points=2_000_000, nb_neighbors=20, std_ratio=2.0,
+                    depth=None, lod_triangles=(500_000, 100_000, 20_000)):
+        """
+        Create mesh from point cloud using Open3D
+        
+        Args:
+            voxel_size (float): Downsampling voxel size; chosen from target_points if None
+            target_points (int): Point budget for automatic voxel size selection
+            nb_neighbors (int): Neighbours considered by statistical outlier removal
+            std_ratio (float): Standard deviation multiplier for outlier removal
+            depth (int): Poisson octree depth; chosen from the point count if None
+            lod_triangles (tuple): Triangle budgets of the decimated levels of detail
+            
+        Returns:
+            list: Paths of the full mesh followed by each level of detail
+        """
         # Load the point cloud
         pcd = o3d.io.read_point_cloud(str(self.dense_dir / "fused.ply"))
         
+        # Voxel downsampling bounds the cost of every later step
+        if voxel_size is not None:
+            pcd = pcd.voxel_down_sample(voxel_size)
+        elif len(pcd.points) > target_points:
+            voxel_size, pcd = self._choose_voxel_size(pcd, target_points)
+        
+        # Remove isolated points left over from stereo fusion
+        pcd, _ = pcd.remove_statistical_outlier(nb_neighbors=nb_neighbors, std_ratio=std_ratio)
+        
         # Estimate normals
+        radius = 0.1 if voxel_size is None else max(0.1, 3 * voxel_size)
         pcd.estimate_normals(
-            search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=0.1, max_nn=30)
+            search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=radius, max_nn=30)
         )
 
         # Create mesh using Poisson reconstruction
+        if depth is None:
+            depth = self._poisson_depth(len(pcd.points))
         mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
-            pcd, depth=9
+            pcd, depth=depth
         )
         
         # Remove low density vertices
+        densities = np.asarray(densities)
         vertices_to_remove = densities < np.quantile(densities, 0.1)
         mesh.remove_vertices_by_mask(vertices_to_remove)
         
         # Save the final mesh
-        o3d.io.write_triangle_mesh(
-            str(self.output_dir / "final_mesh.ply"),
-            mesh
-        )
+        output_paths = [self.output_dir / "final_mesh.ply"]
+        o3d.io.write_triangle_mesh(str(output_paths[0]), mesh)
+        
+        # Decimated levels of detail for Blender import and web viewing
+        for level, triangles in enumerate(sorted(lod_triangles, reverse=True), start=1):
+            if triangles >= len(mesh.triangles):
+                continue
+            lod = mesh.simplify_quadric_decimation(target_number_of_triangles=triangles)
+            lod_path = self.output_dir / f"final_mesh_lod{level}.ply"
+            o3d.io.write_triangle_mesh(str(lod_path), lod)
+            output_paths.append(lod_path)
+        
+        return output_paths
 
-def process_video_to_mesh(video_path, output_dir, start_frame, end_frame):
+def process_video_to_mesh(video_path, output_dir, start_frame, end_frame, stride=1, keyframes_only=False,
+                          matcher="auto", vocab_tree_path=None):
     """
     Main function to process video into 3D mesh
     
@@ -136,15 +363,19 @@ def process_video_to_mesh(video_path, output_dir, start_frame, end_frame):
         output_dir (str): Directory to store output files
         start_frame (int): Starting frame number
         end_frame (int): Ending frame number
+        stride (int): Keep every `stride`-th frame
+        keyframes_only (bool): Keep only frames that differ noticeably from the previous kept one
+        matcher (str): COLMAP matching strategy, see VideoTo3DMesh.run_colmap
+        vocab_tree_path (str): COLMAP vocabulary tree for loop detection / vocab tree matching
     """
     processor = VideoTo3DMesh(video_path, output_dir, start_frame, end_frame)
     
     print("Extracting frames...")
-    num_frames = processor.extract_frames()
+    num_frames = processor.extract_frames(stride=stride, keyframes_only=keyframes_only)
     print(f"Extracted {num_frames} frames")
     
     print("Running COLMAP reconstruction...")
-    processor.run_colmap()
+    processor.run_colmap(matcher=matcher, vocab_tree_path=vocab_tree_path)
     
     print("Creating final mesh...")
     processor.create_mesh()
@@ -5,7 +5,9 @@ from torch.utils.data import Dataset, DataLoader
 from torchvision import transforms
 from PIL import Image
 import numpy as np
+import argparse
 import os
+import time
 
 # Binarization Network
 class BinarizationNet(nn.Module):
@@ -54,6 +56,64 @@ class BinarizationDataset(Dataset):
         binary = (np_img > threshold).astype(np.float32)
         return image, torch.FloatTensor(binary)
 
+# Preprocessed corpus: decode, resize and threshold every image once
+def preprocess_corpus(image_dir, cache_path, size=256):
+    """Write images and targets to `<cache_path>.images.npy` / `.targets.npy`.
+
+    Both are uint8 arrays of shape (N, 1, size, size) that can be opened with
+    mmap_mode, so training never touches the PNG/JPG files again. Both are
+    written under temporary names and moved into place only when complete,
+    targets last, so an interrupted run never leaves a cache that looks
+    usable.
+    """
+    names = sorted(f for f in os.listdir(image_dir) if f.endswith(('.png', '.jpg')))
+    images = np.lib.format.open_memmap(f'{cache_path}.images.tmp.npy', mode='w+',
+                                       dtype=np.uint8, shape=(len(names), 1, size, size))
+    targets = np.lib.format.open_memmap(f'{cache_path}.targets.tmp.npy', mode='w+',
+                                        dtype=np.uint8, shape=(len(names), 1, size, size))
+    
+    resize = transforms.Resize((size, size))
+    for i, name in enumerate(names):
+        image = resize(Image.open(os.path.join(image_dir, name)).convert('L'))
+        np_img = np.asarray(image, dtype=np.uint8)
+        images[i, 0] = np_img
+        # Same mean threshold as BinarizationDataset
+        targets[i, 0] = np_img > np.mean(np_img)
+    
+    images.flush()
+    targets.flush()
+    del images, targets
+    os.replace(f'{cache_path}.images.tmp.npy', f'{cache_path}.images.npy')
+    os.replace(f'{cache_path}.targets.tmp.npy', f'{cache_path}.targets.npy')
+    return len(names)
+
+class CachedBinarizationDataset(Dataset):
+    """Reads samples written by preprocess_corpus from memory-mapped arrays"""
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.images = None
+        self.targets = None
+        # Only the header is read here; each worker maps the arrays itself
+        self.length = np.load(f'{cache_path}.targets.npy', mmap_mode='r').shape[0]
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        if self.images is None:
+            self.images = np.load(f'{self.cache_path}.images.npy', mmap_mode='r')
+            self.targets = np.load(f'{self.cache_path}.targets.npy', mmap_mode='r')
+        
+        image = torch.from_numpy(self.images[idx].astype(np.float32) / 255.0)
+        target = torch.from_numpy(self.targets[idx].astype(np.float32))
+        return image, target
+
+def make_loader(dataset, batch_size=32, num_workers=0, pin_memory=False, shuffle=True):
+    """DataLoader with configurable worker processes and pinned memory"""
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle,
+                      num_workers=num_workers, pin_memory=pin_memory,
+                      persistent_workers=num_workers > 0)
+
 # Training function
 def train_model(model, train_loader, num_epochs, device):
     criterion = nn.BCELoss()
@@ -64,7 +124,8 @@ def train_model(model, train_loader, num_epochs, device):
         running_loss = 0.0
         
         for inputs, targets in train_loader:
-            inputs, targets = inputs.to(device), targets.to(device)
+            inputs = inputs.to(device, non_blocking=True)
+            targets = targets.to(device, non_blocking=True)
             
             optimizer.zero_grad()
             outputs = model(inputs)
@@ -93,24 +154,106 @@ def binarize_image(model, image_path, device):
     
     return binary.cpu().squeeze().numpy()
 
+def _tile_origins(length, tile_size, stride):
+    """Tile start offsets covering [0, length), the last one flush with the edge"""
+    if length <= tile_size:
+        return [0]
+    origins = list(range(0, length - tile_size, stride))
+    origins.append(length - tile_size)
+    return origins
+
+# Tiled binarize function for full-resolution pages
+def binarize_image_tiled(model, image_path, device, tile_size=256, overlap=32,
+                         batch_size=16, num_threads=None):
+    """Binarize a page tile by tile at native resolution.
+
+    Overlapping tiles are averaged before thresholding. Only one batch of
+    tiles is held as a tensor at a time, so memory is bounded by batch_size
+    rather than page size.
+    """
+    if tile_size % 2 or overlap >= tile_size:
+        raise ValueError("tile_size must be even and larger than overlap")
+    if num_threads and device.type == 'cpu':
+        torch.set_num_threads(num_threads)
+    
+    page = np.asarray(Image.open(image_path).convert('L'), dtype=np.float32) / 255.0
+    height, width = page.shape
+    
+    # Pages smaller than one tile are padded up to it
+    pad_h, pad_w = max(tile_size - height, 0), max(tile_size - width, 0)
+    if pad_h or pad_w:
+        page = np.pad(page, ((0, pad_h), (0, pad_w)), mode='edge')
+    
+    stride = tile_size - overlap
+    origins = [(y, x) for y in _tile_origins(page.shape[0], tile_size, stride)
+               for x in _tile_origins(page.shape[1], tile_size, stride)]
+    
+    probabilities = np.zeros(page.shape, dtype=np.float32)
+    weights = np.zeros(page.shape, dtype=np.float32)
+    
+    model.eval()
+    with torch.no_grad():
+        for start in range(0, len(origins), batch_size):
+            batch_origins = origins[start:start + batch_size]
+            tiles = np.stack([page[y:y + tile_size, x:x + tile_size] for y, x in batch_origins])
+            outputs = model(torch.from_numpy(tiles).unsqueeze(1).to(device))
+            outputs = outputs.squeeze(1).cpu().numpy()
+            
+            for (y, x), output in zip(batch_origins, outputs):
+                probabilities[y:y + tile_size, x:x + tile_size] += output
+                weights[y:y + tile_size, x:x + tile_size] += 1
+    
+    probabilities /= weights
+    return (probabilities[:height, :width] > 0.5).astype(np.float32)
+
+def binarize_pages(model, image_paths, device, output_dir, **tile_kwargs):
+    """Binarize a list of pages with tiled inference and report pages per minute"""
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    
+    for image_path in image_paths:
+        binary = binarize_image_tiled(model, image_path, device, **tile_kwargs)
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        Image.fromarray((binary * 255).astype(np.uint8)).save(os.path.join(output_dir, f'{name}_binary.png'))
+    
+    elapsed = time.perf_counter() - start
+    pages_per_minute = len(image_paths) * 60.0 / elapsed if elapsed > 0 else float('inf')
+    print(f'Binarized {len(image_paths)} pages in {elapsed:.1f}s ({pages_per_minute:.1f} pages/min)')
+    return pages_per_minute
+
 # Main execution
 def main():
+    parser = argparse.ArgumentParser(description='Train the binarization network')
+    parser.add_argument('image_dir', type=str, nargs='?', default='path/to/images', help='Directory of training images')
+    parser.add_argument('--cache', type=str, default=None,
+                        help='Preprocessed corpus prefix; built from image_dir if missing')
+    parser.add_argument('--num-workers', type=int, default=0, help='DataLoader worker processes')
+    parser.add_argument('--pin-memory', action='store_true', help='Pin host memory for faster GPU transfer')
+    parser.add_argument('--epochs', type=int, default=10, help='Number of training epochs')
+    args = parser.parse_args()
+    
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     
     # Initialize model
     model = BinarizationNet().to(device)
     
     # Setup dataset and dataloader
-    transform = transforms.Compose([
-        transforms.Resize((256, 256)),
-        transforms.ToTensor()
-    ])
+    if args.cache:
+        if not os.path.exists(f'{args.cache}.targets.npy'):
+            print(f'Preprocessed {preprocess_corpus(args.image_dir, args.cache)} images into {args.cache}')
+        dataset = CachedBinarizationDataset(args.cache)
+    else:
+        transform = transforms.Compose([
+            transforms.Resize((256, 256)),
+            transforms.ToTensor()
+        ])
+        dataset = BinarizationDataset(args.image_dir, transform=transform)
     
-    dataset = BinarizationDataset('path/to/images', transform=transform)
-    train_loader = DataLoader(dataset, batch_size=32, shuffle=True)
+    train_loader = make_loader(dataset, batch_size=32, num_workers=args.num_workers,
+                               pin_memory=args.pin_memory)
     
     # Train model
-    train_model(model, train_loader, num_epochs=10, device=device)
+    train_model(model, train_loader, num_epochs=args.epochs, device=device)
     
     # Save model
     torch.save(model.state_dict(), 'binarization_model.pth')
@@ -7,14 +7,19 @@ import cv2
 from pathlib import Path
 import json
 import shutil
+import hashlib
 import logging
-from dataclasses import dataclass, asdict
-from typing import Tuple, Dict, Optional, List
+import threading
+from dataclasses import dataclass, asdict, replace
+from typing import Callable, Tuple, Dict, Optional, List
 import torch
-from scipy.interpolate import griddata
-from concurrent.futures import ThreadPoolExecutor
-from tqdm import tqdm
-import open3d as o3d
+from colmap_common import collect_images
+from dem_binning import bin_points_chunked, grid_shape
+from dem_fill import fill_gaps
+from dem_mosaic import fill_gaps_tiled
+from dem_tiles import TiledDEM, write_tiled_dem
+from point_filter import filter_point_cloud
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from plyfile import PlyData
 import matplotlib.pyplot as plt
 from PyQt6.QtWidgets import *
@@ -37,7 +42,14 @@ class ReconstructionConfig:
     min_point_density: float = 0.5
     outlier_removal_threshold: float = 2.0
     interpolation_method: str = "linear"
+    max_gap: Optional[float] = None
+    denoise_strength: Optional[float] = None
+    matcher: str = "auto"
+    max_neighbors: int = 20
+    fill_tile_size: Optional[int] = None
     save_intermediate: bool = True
+    dem_tile_size: int = 256
+    preview_max_size: int = 2048
     
     def to_dict(self) -> dict:
         return asdict(self)
@@ -46,12 +58,43 @@ class ReconstructionError(Exception):
     """Custom exception for reconstruction errors."""
     pass
 
+class ReconstructionCancelled(ReconstructionError):
+    """Raised when a running reconstruction is cancelled between or during stages."""
+    pass
+
 class ImageProcessor:
     """Handles image preprocessing and validation."""
     
+    # Bump when the preprocessing steps change so cached outputs are rebuilt
+    CACHE_VERSION = 1
+    
+    @staticmethod
+    def estimate_noise(gray: np.ndarray) -> float:
+        """Estimate the Gaussian noise sigma of a grayscale image (Immerkaer's method).
+
+        A Laplacian-difference kernel cancels image structure, so the mean
+        absolute response measures noise alone; one filter pass, no FFT.
+        """
+        kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+        response = cv2.filter2D(gray.astype(np.float32), -1, kernel)[1:-1, 1:-1]
+        height, width = gray.shape
+        return float(np.abs(response).sum() * np.sqrt(np.pi / 2) / (6 * (width - 2) * (height - 2)))
+    
+    @staticmethod
+    def denoise_strength(sigma: float, min_strength: float = 1.0, max_strength: float = 15.0) -> float:
+        """Non-local means filter strength h for a noise sigma; 0 means skip denoising."""
+        if sigma < min_strength:
+            return 0.0
+        return float(min(sigma, max_strength))
+    
     @staticmethod
-    def validate_and_preprocess(image_path: str) -> np.ndarray:
-        """Validate and preprocess input image."""
+    def validate_and_preprocess(image_path: str, strength: Optional[float] = None) -> np.ndarray:
+        """Validate and preprocess input image.
+
+        The denoising strength follows the noise estimated on the equalized
+        image unless `strength` is given; clean images skip the (expensive)
+        non-local means pass entirely.
+        """
         if not os.path.exists(image_path):
             raise ReconstructionError(f"Image not found: {image_path}")
             
@@ -66,33 +109,91 @@ class ImageProcessor:
         # Basic preprocessing
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         equalized = cv2.equalizeHist(gray)
-        denoised = cv2.fastNlMeansDenoising(equalized)
+        if strength is None:
+            strength = ImageProcessor.denoise_strength(ImageProcessor.estimate_noise(equalized))
+        if strength <= 0:
+            return equalized
+        denoised = cv2.fastNlMeansDenoising(equalized, None, strength)
         
         return denoised
+    
+    @staticmethod
+    def cache_key(image_path: str, strength: Optional[float] = None) -> str:
+        """Hash of the source bytes and preprocessing settings."""
+        digest = hashlib.sha1()
+        with open(image_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        digest.update(f"v{ImageProcessor.CACHE_VERSION}:{strength}".encode())
+        return digest.hexdigest()[:16]
+    
+    @staticmethod
+    def _preprocess_to_file(image_path: str, output_path: str, strength: Optional[float]) -> str:
+        """Process-pool job: preprocess one image and write it as a lossless PNG."""
+        image = ImageProcessor.validate_and_preprocess(image_path, strength)
+        # Write under a temporary name so an interrupted run never leaves a partial cache entry
+        tmp_path = output_path + ".tmp.png"
+        if not cv2.imwrite(tmp_path, image):
+            raise ReconstructionError(f"Failed to write preprocessed image: {output_path}")
+        os.replace(tmp_path, output_path)
+        return output_path
+    
+    @staticmethod
+    def preprocess_images(image_paths: List[str], cache_dir: Path, workers: Optional[int] = None,
+                          strength: Optional[float] = None) -> List[Path]:
+        """Preprocess any number of images concurrently, with a content-addressed cache.
+
+        Outputs are lossless PNGs named by ImageProcessor.cache_key, so
+        images already preprocessed with the same settings are skipped and
+        nothing is re-encoded lossily before COLMAP reads it. Returns the
+        output paths in input order.
+        """
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        
+        outputs, pending = [], {}
+        for image_path in image_paths:
+            if not os.path.exists(image_path):
+                raise ReconstructionError(f"Image not found: {image_path}")
+            output_path = cache_dir / f"{ImageProcessor.cache_key(image_path, strength)}.png"
+            outputs.append(output_path)
+            if not output_path.exists():
+                pending[str(output_path)] = str(image_path)
+        
+        logging.info(f"Preprocessing {len(pending)} of {len(outputs)} images ({len(outputs) - len(pending)} cached)")
+        if len(pending) == 1:
+            output_path, image_path = next(iter(pending.items()))
+            ImageProcessor._preprocess_to_file(image_path, output_path, strength)
+        elif pending:
+            with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(pending))) as executor:
+                futures = [
+                    executor.submit(ImageProcessor._preprocess_to_file, image_path, output_path, strength)
+                    for output_path, image_path in pending.items()
+                ]
+                for future in futures:
+                    future.result()
+        
+        return outputs
 
 class PointCloudProcessor:
     """Handles point cloud processing and optimization."""
     
     @staticmethod
     def process_point_cloud(points: np.ndarray, config: ReconstructionConfig) -> np.ndarray:
-        """Process and optimize point cloud data."""
-        pcd = o3d.geometry.PointCloud()
-        pcd.points = o3d.utility.Vector3dVector(points)
-        
-        # Remove outliers
-        pcd, _ = pcd.remove_statistical_outlier(
+        """Process and optimize point cloud data.
+
+        Outlier removal (chunked KD-tree queries on config.num_workers
+        threads) and voxel downsampling (np.unique over packed voxel keys)
+        work on the array directly, so no Open3D copy of the cloud is made.
+        """
+        # Remove outliers, then optionally optimize point cloud density
+        return filter_point_cloud(
+            points,
             nb_neighbors=20,
-            std_ratio=config.outlier_removal_threshold
+            std_ratio=config.outlier_removal_threshold,
+            voxel_size=config.min_point_density,
+            workers=config.num_workers
         )
-        
-        # Estimate normals
-        pcd.estimate_normals()
-        
-        # Optional: Optimize point cloud density
-        if config.min_point_density > 0:
-            pcd = pcd.voxel_down_sample(voxel_size=config.min_point_density)
-        
-        return np.asarray(pcd.points)
 
 class DEMGenerator:
     """Handles DEM generation and interpolation."""
@@ -108,8 +209,8 @@ class DEMGenerator:
             else:
                 dem, metadata = DEMGenerator._generate_dem_cpu(points, config)
             
-            # Validate DEM
-            if np.isnan(dem).any():
+            # Validate DEM; voids beyond max_gap are deliberately left as NaN
+            if config.max_gap is None and np.isnan(dem).any():
                 raise ReconstructionError("DEM contains invalid values")
             
             return dem, metadata
@@ -167,29 +268,9 @@ class DEMGenerator:
         x_min, x_max = points[:, 0].min(), points[:, 0].max()
         y_min, y_max = points[:, 1].min(), points[:, 1].max()
         
-        x_grid = np.arange(x_min, x_max + config.grid_size, config.grid_size)
-        y_grid = np.arange(y_min, y_max + config.grid_size, config.grid_size)
-        
-        dem = np.zeros((len(y_grid), len(x_grid)))
-        dem_count = np.zeros_like(dem)
-        
-        # Process points in batches
-        batch_size = 10000
-        for i in tqdm(range(0, len(points), batch_size), desc="Generating DEM"):
-            batch = points[i:i+batch_size]
-            x_idx = ((batch[:, 0] - x_min) / config.grid_size).astype(int)
-            y_idx = ((batch[:, 1] - y_min) / config.grid_size).astype(int)
-            
-            valid_points = (x_idx >= 0) & (x_idx < dem.shape[1]) & (y_idx >= 0) & (y_idx < dem.shape[0])
-            x_idx = x_idx[valid_points]
-            y_idx = y_idx[valid_points]
-            z_values = batch[valid_points, 2]
-            
-            np.add.at(dem, (y_idx, x_idx), z_values)
-            np.add.at(dem_count, (y_idx, x_idx), 1)
-        
-        mask = dem_count > 0
-        dem[mask] /= dem_count[mask]
+        # One bincount pair per chunk into a single sum/count grid
+        shape = grid_shape(x_min, x_max, y_min, y_max, config.grid_size)
+        dem, mask = bin_points_chunked(points, x_min, y_min, config.grid_size, shape)
         
         return DEMGenerator._interpolate_gaps(dem, mask, config), {
             "x_min": x_min,
@@ -202,23 +283,11 @@ class DEMGenerator:
     
     @staticmethod
     def _interpolate_gaps(dem: np.ndarray, mask: np.ndarray, config: ReconstructionConfig) -> np.ndarray:
-        """Interpolate empty cells in the DEM."""
-        if not mask.all():
-            y_coords, x_coords = np.where(mask)
-            values = dem[mask]
-            
-            yi, xi = np.where(~mask)
-            points_known = np.column_stack([x_coords, y_coords])
-            points_unknown = np.column_stack([xi, yi])
-            
-            if len(points_unknown) > 0:
-                interpolated = griddata(
-                    points_known, values, points_unknown,
-                    method=config.interpolation_method
-                )
-                dem[~mask] = interpolated
-        
-        return dem
+        """Interpolate empty cells in the DEM, tile by tile in parallel when fill_tile_size is set."""
+        if config.fill_tile_size:
+            return fill_gaps_tiled(dem, mask, config.interpolation_method, config.max_gap,
+                                   tile_size=config.fill_tile_size, workers=config.num_workers)
+        return fill_gaps(dem, mask, config.interpolation_method, config.max_gap)
 
 class AerialReconstructor:
     """Main class for aerial reconstruction pipeline."""
@@ -229,12 +298,18 @@ class AerialReconstructor:
         self.setup_workspace()
         self.device = torch.device("cuda" if self.config.use_gpu and torch.cuda.is_available() else "cpu")
         self.setup_logging()
+        
+        # Hooks set per run by process_images (used by the GUI worker)
+        self.stage_callback: Optional[Callable[[str, float], None]] = None
+        self.product_callback: Optional[Callable[[str, object], None]] = None
+        self.cancel_event: Optional[threading.Event] = None
     
     def setup_workspace(self):
         """Setup workspace directories."""
         dirs = [
             self.workspace,
             self.workspace / "images",
+            self.workspace / "preprocessed",
             self.workspace / "sparse",
             self.workspace / "dense",
             self.workspace / "results"
@@ -253,59 +328,135 @@ class AerialReconstructor:
             ]
         )
     
-    def process_images(self, image1_path: str, image2_path: str) -> Tuple[np.ndarray, Dict]:
-        """Process images and generate DEM."""
+    STAGES = ["preprocessing", "colmap", "point_cloud", "dem", "saving"]
+    
+    def check_cancelled(self):
+        """Raise ReconstructionCancelled if the current run has been cancelled."""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ReconstructionCancelled("Reconstruction cancelled")
+    
+    def report_stage(self, stage: str):
+        """Check for cancellation, then report the stage and overall progress (0-1)."""
+        self.check_cancelled()
+        logging.info(f"Stage: {stage}")
+        if self.stage_callback is not None:
+            self.stage_callback(stage, self.STAGES.index(stage) / len(self.STAGES))
+    
+    def report_product(self, name: str, product):
+        """Hand an intermediate product (e.g. sparse/dense cloud, DEM) to the caller."""
+        if self.product_callback is not None:
+            self.product_callback(name, product)
+    
+    def process_images(self, image1_path: str, image2_path: str,
+                       stage_callback: Optional[Callable[[str, float], None]] = None,
+                       product_callback: Optional[Callable[[str, object], None]] = None,
+                       cancel_event: Optional[threading.Event] = None) -> Tuple[np.ndarray, Dict]:
+        """Process images and generate DEM.
+
+        stage_callback(stage, fraction) is called as each stage starts,
+        product_callback(name, product) receives intermediate results as soon
+        as they exist, and setting cancel_event stops the run with
+        ReconstructionCancelled at the next check.
+        """
+        return self.process_block([image1_path, image2_path], stage_callback=stage_callback,
+                                  product_callback=product_callback, cancel_event=cancel_event)
+    
+    def process_block(self, images, fill_tile_size: Optional[int] = 1024,
+                      stage_callback: Optional[Callable[[str, float], None]] = None,
+                      product_callback: Optional[Callable[[str, object], None]] = None,
+                      cancel_event: Optional[threading.Event] = None) -> Tuple[np.ndarray, Dict]:
+        """Reconstruct an overlapping block of images (directory or list) into one merged DEM.
+
+        The whole block goes through COLMAP at once, matched according to
+        config.matcher; for more than two images the gap fill runs on
+        fill_tile_size tiles in parallel and the tiles are feathered together.
+        Callbacks and cancel_event behave as in process_images.
+        """
+        image_paths = [str(p) for p in collect_images(images)]
+        if len(image_paths) < 2:
+            raise ReconstructionError(f"Need at least two images, found {len(image_paths)}")
+        dem_config = self.config
+        if len(image_paths) > 2 and fill_tile_size:
+            dem_config = replace(self.config, fill_tile_size=fill_tile_size)
+        
+        self.stage_callback = stage_callback
+        self.product_callback = product_callback
+        self.cancel_event = cancel_event
         try:
             logging.info("Starting reconstruction pipeline...")
             
             # Validate and preprocess images
-            img1 = ImageProcessor.validate_and_preprocess(image1_path)
-            img2 = ImageProcessor.validate_and_preprocess(image2_path)
-            
-            # Save preprocessed images
-            if self.config.save_intermediate:
-                cv2.imwrite(str(self.workspace / "images" / "preprocessed_1.jpg"), img1)
-                cv2.imwrite(str(self.workspace / "images" / "preprocessed_2.jpg"), img2)
+            self.report_stage("preprocessing")
+            image_paths = ImageProcessor.preprocess_images(
+                image_paths, self.workspace / "preprocessed",
+                workers=self.config.num_workers, strength=self.config.denoise_strength
+            )
             
             # Run COLMAP pipeline
-            points = self.run_colmap_pipeline(img1, img2)
+            self.report_stage("colmap")
+            points = self.run_colmap_pipeline(image_paths)
+            self.report_product("dense_cloud", points)
             
             # Process point cloud
+            self.report_stage("point_cloud")
             points = PointCloudProcessor.process_point_cloud(points, self.config)
+            self.report_product("filtered_cloud", points)
             
             # Generate DEM
-            dem, metadata = DEMGenerator.generate_dem(points, self.config, self.device)
+            self.report_stage("dem")
+            dem, metadata = DEMGenerator.generate_dem(points, dem_config, self.device)
+            metadata["num_images"] = len(image_paths)
+            self.report_product("dem", (dem, metadata))
             
             # Save results
+            self.report_stage("saving")
             self.save_results(dem, metadata)
             
             logging.info("Reconstruction completed successfully")
             return dem, metadata
             
+        except ReconstructionCancelled:
+            logging.info("Reconstruction cancelled")
+            raise
         except Exception as e:
             logging.error(f"Reconstruction failed: {str(e)}")
             raise
+        finally:
+            self.stage_callback = self.product_callback = self.cancel_event = None
     
-    def run_colmap_pipeline(self, img1: np.ndarray, img2: np.ndarray) -> np.ndarray:
-        """Run COLMAP reconstruction pipeline."""
+    def run_colmap_pipeline(self, image_paths: List[Path]) -> np.ndarray:
+        """Run COLMAP reconstruction pipeline on preprocessed images."""
         # Implementation of COLMAP pipeline would go here
         # This is a placeholder that should be replaced with actual COLMAP integration
         raise NotImplementedError("COLMAP pipeline not implemented")
     
     def save_results(self, dem: np.ndarray, metadata: Dict):
-        """Save reconstruction results."""
+        """Save reconstruction results.
+
+        Besides dem.npy the DEM is written as a tiled store with overview
+        levels (results/dem_tiles, described under "tiles" in
+        metadata.json), and the PNG preview is drawn from the finest
+        overview that fits preview_max_size instead of the full grid.
+        """
         results_dir = self.workspace / "results"
         
         # Save DEM as numpy array
         np.save(str(results_dir / "dem.npy"), dem)
         
+        # Tiled store with overviews for windowed / zoomed reads
+        tiles = write_tiled_dem(dem, results_dir / "dem_tiles", tile_size=self.config.dem_tile_size)
+        metadata = {**metadata, "tiles": tiles}
+        
         # Save metadata
         with open(str(results_dir / "metadata.json"), "w") as f:
-            json.dump(metadata, f, indent=2)
+            json.dump(metadata, f, indent=2, default=float)
         
         # Save visualization
+        store = TiledDEM(results_dir / "dem_tiles", tiles)
+        preview = store.read_level(store.best_level(self.config.preview_max_size))
         plt.figure(figsize=(10, 8))
-        plt.imshow(dem, cmap='terrain')
+        plt.imshow(preview, cmap='terrain',
+                   extent=(metadata['x_min'], metadata['x_max'], metadata['y_max'], metadata['y_min']))
         plt.colorbar(label='Elevation (m)')
         plt.title('Digital Elevation Model')
         plt.xlabel('X (m)')
@@ -0,0 +1,28 @@
+# Save as colmap_common.py
+from pathlib import Path
+from typing import List, Sequence
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff"}
+MATCHERS = ("auto", "exhaustive", "sequential", "spatial")
+
+def collect_images(source) -> List[Path]:
+    """Image paths from a directory (sorted by name) or an explicit list of files."""
+    if isinstance(source, (str, Path)) and Path(source).is_dir():
+        return sorted(p for p in Path(source).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    return [Path(p) for p in source]
+
+def matcher_command(matcher: str, database_path: Path, max_neighbors: int = 20,
+                    options: Sequence[str] = ()) -> List[str]:
+    """`colmap <matcher>_matcher` command line for a resolved matcher (see colmap_stats.resolve_matcher).
+
+    max_neighbors bounds the spatial neighbours or the sequential overlap;
+    `options` are extra SiftMatching flags passed through unchanged.
+    """
+    if matcher not in MATCHERS[1:]:
+        raise ValueError(f"Unknown matcher '{matcher}'")
+    command = ["colmap", f"{matcher}_matcher", "--database_path", str(database_path), *options]
+    if matcher == "spatial":
+        command += ["--SpatialMatching.max_num_neighbors", str(max_neighbors)]
+    elif matcher == "sequential":
+        command += ["--SequentialMatching.overlap", str(max_neighbors)]
+    return command
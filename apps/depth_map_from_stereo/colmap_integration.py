@@ -1,34 +1,165 @@
 # Save as colmap_integration.py
 import subprocess
 import os
-import sqlite3
+import shutil
+import sys
+import json
+import time
+import hashlib
+import threading
+from collections import deque
 import numpy as np
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+from ply_stream import read_ply_points
+from colmap_stats import reconstruction_stats, resolve_matcher
+from colmap_common import matcher_command
 
 class COLMAPRunner:
     """Handles COLMAP command execution and database interactions."""
     
-    def __init__(self, workspace: Path, use_gpu: bool = True):
+    def __init__(self, workspace: Path, use_gpu: bool = True,
+                 progress_callback: Optional[Callable[[str, str], None]] = None, force: bool = False,
+                 cancel_event: Optional[threading.Event] = None):
         self.workspace = workspace
         self.database_path = workspace / "database.db"
         self.image_path = workspace / "images"
         self.sparse_path = workspace / "sparse"
         self.dense_path = workspace / "dense"
         self.use_gpu = use_gpu
+        self.progress_callback = progress_callback
+        self.force = force
+        self.cancel_event = cancel_event
+        self.manifest_path = workspace / "stages.json"
+        self.manifest = self._load_manifest()
+        # Hash of the last completed stage; each stage's hash chains from it
+        self._upstream_hash = ""
+
+    def _load_manifest(self) -> Dict:
+        if self.manifest_path.exists():
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        return {}
+
+    def _save_manifest(self) -> None:
+        with open(self.manifest_path, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+
+    @staticmethod
+    def _fingerprint(paths: List[Path]) -> List[Tuple[str, int, int]]:
+        """(name, size, mtime) of every file under the given paths."""
+        entries = []
+        for path in paths:
+            files = sorted(path.rglob("*")) if path.is_dir() else [path]
+            for file in files:
+                if file.is_file():
+                    stat = file.stat()
+                    entries.append((str(file), stat.st_size, stat.st_mtime_ns))
+        return entries
+
+    def _stage_hash(self, command: List[str], inputs: List[Path]) -> str:
+        payload = json.dumps([self._upstream_hash, command, self._fingerprint(inputs)])
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def run_command(self, command: List[str], desc: str) -> Dict:
+        """Execute a COLMAP command, streaming its output lines to the progress callback.
+
+        Returns the exit code, wall time and peak resident memory of the
+        child (where the platform reports it). Raises RuntimeError with the
+        tail of the log on failure, and terminates the child and raises
+        ReconstructionCancelled once cancel_event is set.
+        """
+        start = time.time()
+        tail = deque(maxlen=50)
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1
+        )
+        for line in process.stdout:
+            line = line.rstrip()
+            tail.append(line)
+            if self.progress_callback is not None:
+                self.progress_callback(desc, line)
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                process.terminate()
+                tail.append("cancelled")
+                break
+        process.stdout.close()
+
+        peak_rss_mb = None
+        if hasattr(os, "wait4"):
+            # wait4 reports the resource usage of this child alone
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+            peak_rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+        else:
+            process.wait()
+
+        stats = {
+            "returncode": process.returncode,
+            "seconds": round(time.time() - start, 2),
+            "peak_rss_mb": None if peak_rss_mb is None else round(peak_rss_mb, 1)
+        }
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ReconstructionCancelled(f"COLMAP {desc} cancelled")
+        if process.returncode != 0:
+            raise RuntimeError(f"COLMAP {desc} failed: " + "\n".join(tail))
+        return stats
+
+    def run_stage(self, name: str, command: List[str], desc: str,
+                  outputs: List[Path], inputs: Optional[List[Path]] = None,
+                  clean: Optional[List[Path]] = None) -> bool:
+        """Run a stage unless the manifest holds the same input hash and its outputs exist.
+
+        The hash covers the command, the fingerprint of `inputs` and the
+        hash of the preceding stage, so any upstream change reruns
+        everything after it. Paths in `clean` are deleted, and every other
+        manifest entry dropped, before the stage runs. Returns True if the
+        stage ran.
+        """
+        stage_hash = self._stage_hash(command, inputs or [])
+        entry = self.manifest.get(name, {})
+        if (not self.force and entry.get("status") == "done" and entry.get("hash") == stage_hash
+                and all(p.exists() for p in outputs)):
+            if self.progress_callback is not None:
+                self.progress_callback(desc, "skipped (outputs up to date)")
+            self._upstream_hash = stage_hash
+            return False
+
+        if clean:
+            self._clean(clean)
+            self.manifest = {}
+            self._save_manifest()
 
-    def run_command(self, command: List[str], desc: str) -> None:
-        """Execute COLMAP command with proper error handling."""
         try:
-            result = subprocess.run(
-                command,
-                check=True,
-                capture_output=True,
-                text=True
-            )
-            return result.stdout
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"COLMAP {desc} failed: {e.stderr}")
+            stats = self.run_command(command, desc)
+        except (RuntimeError, ReconstructionCancelled):
+            self.manifest[name] = {"status": "failed", "hash": stage_hash}
+            self._save_manifest()
+            raise
+
+        self.manifest[name] = {"status": "done", "hash": stage_hash, **stats}
+        self._save_manifest()
+        self._upstream_hash = stage_hash
+        return True
+
+    @staticmethod
+    def _clean(paths: List[Path]) -> None:
+        """Delete stale files, and empty stale directories, left by an earlier run."""
+        for path in paths:
+            if path.is_dir():
+                shutil.rmtree(path)
+                path.mkdir(parents=True)
+            elif path.exists():
+                path.unlink()
+
+    def stage_report(self) -> Dict[str, Dict]:
+        """Status, wall time and peak RSS recorded for each stage."""
+        return {name: dict(entry) for name, entry in self.manifest.items()}
 
     def feature_extraction(self) -> None:
         """Extract features from images."""
@@ -42,20 +173,36 @@ class COLMAPRunner:
             "--SiftExtraction.estimate_affine_shape", "1",
             "--SiftExtraction.domain_size_pooling", "1"
         ]
-        self.run_command(command, "feature extraction")
+        # feature_extractor skips image names already in the database, so a
+        # rerun starts from an empty database and drops everything built on it
+        self.run_stage("features", command, "feature extraction",
+                       outputs=[self.database_path], inputs=[self.image_path],
+                       clean=[self.database_path, self.sparse_path, self.dense_path])
 
-    def feature_matching(self) -> None:
-        """Match features between images."""
-        command = [
-            "colmap", "exhaustive_matcher",
-            "--database_path", str(self.database_path),
+    # Above this many images "auto" switches from exhaustive to spatial matching
+    EXHAUSTIVE_LIMIT = 20
+
+    def feature_matching(self, matcher: str = "exhaustive", max_neighbors: int = 20) -> None:
+        """Match features between images.
+
+        "spatial" matches each image only with its max_neighbors nearest
+        images by EXIF GPS position and "sequential" with the next ones in
+        name order, so a sortie is not matched all-pairs; "auto" picks
+        exhaustive up to EXHAUSTIVE_LIMIT images and spatial beyond. Spatial
+        matching is only used when the database holds position priors and
+        falls back to sequential otherwise (the preprocessed PNGs carry no
+        EXIF, so this is the usual case).
+        """
+        num_images = sum(1 for p in self.image_path.iterdir() if p.is_file())
+        matcher = resolve_matcher(matcher, num_images, self.database_path, self.EXHAUSTIVE_LIMIT)
+        command = matcher_command(matcher, self.database_path, max_neighbors, [
             "--SiftMatching.use_gpu", str(int(self.use_gpu)),
             "--SiftMatching.guided_matching", "1",
             "--SiftMatching.max_num_trials", "50000",
             "--SiftMatching.confidence", "0.999",
             "--SiftMatching.max_error", "4"
-        ]
-        self.run_command(command, "feature matching")
+        ])
+        self.run_stage("matches", command, "feature matching", outputs=[self.database_path])
 
     def sparse_reconstruction(self) -> None:
         """Run sparse reconstruction."""
@@ -69,7 +216,7 @@ class COLMAPRunner:
             "--Mapper.multiple_models", "0",
             "--Mapper.extract_colors", "1"
         ]
-        self.run_command(command, "sparse reconstruction")
+        self.run_stage("sparse", command, "sparse reconstruction", outputs=[self.sparse_path / "0"])
 
     def dense_reconstruction(self) -> None:
         """Run dense reconstruction pipeline."""
@@ -82,7 +229,8 @@ class COLMAPRunner:
             "--output_type", "COLMAP",
             "--max_image_size", "3200"
         ]
-        self.run_command(command_undistort, "image undistortion")
+        self.run_stage("undistort", command_undistort, "image undistortion",
+                       outputs=[self.dense_path / "images"])
 
         # Dense stereo
         command_stereo = [
@@ -97,7 +245,7 @@ class COLMAPRunner:
             "--PatchMatchStereo.num_samples", "15",
             "--PatchMatchStereo.num_iterations", "5"
         ]
-        self.run_command(command_stereo, "dense stereo")
+        self.run_stage("stereo", command_stereo, "dense stereo", outputs=[self.dense_path / "stereo"])
 
         # Stereo fusion
         command_fusion = [
@@ -111,61 +259,60 @@ class COLMAPRunner:
             "--StereoFusion.max_depth_error", "0.1",
             "--StereoFusion.max_normal_error", "10"
         ]
-        self.run_command(command_fusion, "stereo fusion")
+        self.run_stage("fusion", command_fusion, "stereo fusion", outputs=[self.dense_path / "fused.ply"])
 
     def get_reconstruction_stats(self) -> dict:
-        """Get statistics about the reconstruction."""
-        stats = {}
-        
-        # Read database statistics
-        with sqlite3.connect(str(self.database_path)) as conn:
-            cur = conn.cursor()
-            
-            # Get keypoint statistics
-            cur.execute("SELECT COUNT(*) FROM keypoints")
-            stats['total_keypoints'] = cur.fetchone()[0]
-            
-            # Get match statistics
-            cur.execute("SELECT COUNT(*) FROM matches")
-            stats['total_matches'] = cur.fetchone()[0]
-            
-            # Get image statistics
-            cur.execute("SELECT COUNT(*) FROM images")
-            stats['total_images'] = cur.fetchone()[0]
-        
-        # Read point cloud statistics if available
-        if (self.dense_path / "fused.ply").exists():
-            from plyfile import PlyData
-            ply_data = PlyData.read(str(self.dense_path / "fused.ply"))
-            stats['dense_points'] = len(ply_data['vertex'])
-        
-        return stats
+        """Get statistics about the reconstruction.
+
+        Counts come from the `rows` column of the keypoints/matches tables
+        and the dense point count from the PLY header, so this stays
+        instant on multi-gigabyte workspaces.
+        """
+        return reconstruction_stats(self.workspace)
 
 # Update the reconstruction pipeline implementation in reconstruction_pipeline.py
 
-def run_colmap_pipeline(self, img1: np.ndarray, img2: np.ndarray) -> np.ndarray:
-    """Run COLMAP reconstruction pipeline."""
+def run_colmap_pipeline(self, image_paths: List[Path]) -> np.ndarray:
+    """Run COLMAP reconstruction pipeline on preprocessed images."""
     try:
-        # Initialize COLMAP runner
-        colmap = COLMAPRunner(self.workspace, self.config.use_gpu)
-        
-        # Save images for COLMAP
-        cv2.imwrite(str(self.workspace / "images" / "image1.jpg"), img1)
-        cv2.imwrite(str(self.workspace / "images" / "image2.jpg"), img2)
+        # Initialize COLMAP runner; output lines go to the debug log
+        colmap = COLMAPRunner(self.workspace, self.config.use_gpu,
+                              progress_callback=lambda stage, line: logging.debug(f"[{stage}] {line}"),
+                              cancel_event=self.cancel_event)
+        
+        # Stage the preprocessed PNGs for COLMAP; unchanged images are not
+        # rewritten so their fingerprint, and every completed stage after
+        # them, stays valid. Images from a previous, different set are removed.
+        image_dir = self.workspace / "images"
+        names = set()
+        for index, source in enumerate(image_paths, start=1):
+            image_file = image_dir / f"image{index}.png"
+            names.add(image_file.name)
+            if not image_file.exists() or image_file.read_bytes() != source.read_bytes():
+                shutil.copyfile(source, image_file)
+        for stale in image_dir.iterdir():
+            if stale.is_file() and stale.name not in names:
+                stale.unlink()
         
         # Run COLMAP pipeline
         logging.info("Running feature extraction...")
         colmap.feature_extraction()
         
+        self.check_cancelled()
         logging.info("Running feature matching...")
-        colmap.feature_matching()
+        colmap.feature_matching(self.config.matcher, self.config.max_neighbors)
         
+        self.check_cancelled()
         logging.info("Running sparse reconstruction...")
         colmap.sparse_reconstruction()
+        self.report_product("sparse_model", self.workspace / "sparse" / "0")
         
+        self.check_cancelled()
         logging.info("Running dense reconstruction...")
         colmap.dense_reconstruction()
         
+        logging.info(f"COLMAP stage timings: {colmap.stage_report()}")
+        
         # Get reconstruction statistics
         stats = colmap.get_reconstruction_stats()
         logging.info(f"Reconstruction statistics: {stats}")
@@ -175,14 +322,8 @@ def run_colmap_pipeline(self, img1: np.ndarray, img2: np.ndarray) -> np.ndarray:
         if not ply_path.exists():
             raise RuntimeError("Dense reconstruction failed to produce point cloud")
             
-        ply_data = PlyData.read(str(ply_path))
-        points = np.vstack([
-            ply_data['vertex']['x'],
-            ply_data['vertex']['y'],
-            ply_data['vertex']['z']
-        ]).T
-        
-        return points
+        # Copy x/y/z straight out of the memory-mapped vertex block
+        return read_ply_points(ply_path)
         
     except Exception as e:
         logging.error(f"COLMAP pipeline failed: {str(e)}")
@@ -194,9 +335,13 @@ class DEMVisualizer:
     """Advanced DEM visualization tools."""
     
     @staticmethod
-    def create_shaded_relief(dem: np.ndarray, metadata: dict) -> np.ndarray:
-        """Create shaded relief visualization."""
-        dx, dy = np.gradient(dem)
+    def create_shaded_relief(dem: np.ndarray, metadata: dict, step: int = 1) -> np.ndarray:
+        """Create shaded relief visualization.
+
+        `step` is the stride the DEM was subsampled with; slopes are taken
+        over step * grid_size metres so a coarse view is not exaggerated.
+        """
+        dx, dy = np.gradient(dem, metadata.get('grid_size', 1.0) * step)
         slope = np.pi/2.0 - np.arctan(np.sqrt(dx*dx + dy*dy))
         aspect = np.arctan2(-dx, dy)
         
@@ -210,13 +355,10 @@ class DEMVisualizer:
         return shaded
 
     @staticmethod
-    def create_contour_plot(fig: Figure, dem: np.ndarray, metadata: dict) -> None:
+    def create_contour_plot(fig: Figure, dem: np.ndarray, levels: np.ndarray) -> None:
         """Create contour plot visualization."""
         ax = fig.add_subplot(111)
         
-        # Calculate contour levels
-        levels = np.linspace(dem.min(), dem.max(), 20)
-        
         # Create contour plot
         contour = ax.contour(dem, levels=levels, colors='black', alpha=0.5)
         filled = ax.contourf(dem, levels=levels, cmap='terrain')
@@ -231,17 +373,12 @@ class DEMVisualizer:
         ax.set_ylabel('Y (m)')
 
     @staticmethod
-    def create_3d_plot(fig: Figure, dem: np.ndarray, metadata: dict) -> None:
+    def create_3d_plot(fig: Figure, X: np.ndarray, Y: np.ndarray, Z: np.ndarray) -> None:
         """Create 3D surface plot."""
         ax = fig.add_subplot(111, projection='3d')
         
-        # Create coordinate grids
-        x = np.linspace(metadata['x_min'], metadata['x_max'], dem.shape[1])
-        y = np.linspace(metadata['y_min'], metadata['y_max'], dem.shape[0])
-        X, Y = np.meshgrid(x, y)
-        
         # Create 3D surface plot
-        surf = ax.plot_surface(X, Y, dem, cmap='terrain', linewidth=0)
+        surf = ax.plot_surface(X, Y, Z, cmap='terrain', linewidth=0)
         fig.colorbar(surf, label='Elevation (m)')
         
         ax.set_title('3D Terrain Model')
@@ -249,6 +386,134 @@ class DEMVisualizer:
         ax.set_ylabel('Y (m)')
         ax.set_zlabel('Elevation (m)')
 
+class DEMRenderCache:
+    """Derived DEM products (hillshade, contour levels, surface mesh), computed once per DEM.
+
+    Products are plain arrays keyed by (generation, product, max_size) so
+    they can be computed off the GUI thread; drawing them stays on the GUI
+    thread. Each new DEM starts a new generation, and results computed for
+    an older one are returned to their caller but never stored.
+    """
+    
+    SURFACE_MAX_SIZE = 150  # plot_surface cost grows with every quad
+    
+    def __init__(self):
+        self._products: Dict[Tuple[int, str, Optional[int]], dict] = {}
+        self._lock = threading.Lock()
+        self.generation = 0
+    
+    def reset(self) -> int:
+        """Drop every product and start a new generation for a new DEM; returns it."""
+        with self._lock:
+            self._products.clear()
+            self.generation += 1
+            return self.generation
+    
+    def lookup(self, product: str, max_size: Optional[int], generation: int) -> Optional[dict]:
+        with self._lock:
+            return self._products.get((generation, product, max_size))
+    
+    def get(self, dem: np.ndarray, metadata: dict, product: str, max_size: Optional[int],
+            generation: int) -> dict:
+        """Return the cached product, computing it on a miss."""
+        cached = self.lookup(product, max_size, generation)
+        if cached is not None:
+            return cached
+        data = self.compute(dem, metadata, product, max_size)
+        with self._lock:
+            if generation == self.generation:
+                self._products[(generation, product, max_size)] = data
+        return data
+    
+    @staticmethod
+    def stride(dem: np.ndarray, max_size: Optional[int]) -> int:
+        """Step that brings the DEM's larger side to at most max_size cells (None keeps full resolution)."""
+        if max_size is None:
+            return 1
+        return max(1, int(np.ceil(max(dem.shape) / max_size)))
+    
+    @staticmethod
+    def compute(dem: np.ndarray, metadata: dict, product: str, max_size: Optional[int]) -> dict:
+        if product == '3D Surface' and max_size is not None:
+            max_size = min(max_size, DEMRenderCache.SURFACE_MAX_SIZE)
+        step = DEMRenderCache.stride(dem, max_size)
+        view = dem[::step, ::step]
+        
+        if product == 'Shaded Relief':
+            return {'image': DEMVisualizer.create_shaded_relief(view, metadata, step)}
+        if product == 'Contour Map':
+            return {'dem': view, 'levels': np.linspace(np.nanmin(view), np.nanmax(view), 20)}
+        if product == '3D Surface':
+            x = np.linspace(metadata['x_min'], metadata['x_max'], view.shape[1])
+            y = np.linspace(metadata['y_min'], metadata['y_max'], view.shape[0])
+            X, Y = np.meshgrid(x, y)
+            return {'X': X, 'Y': Y, 'Z': view}
+        raise ValueError(f"Unknown visualization: {product}")
+
+class RenderSignals(QObject):
+    """Signals emitted by RenderTask."""
+    finished = pyqtSignal(int, str, object)
+
+class RenderTask(QRunnable):
+    """Computes one DEM product in the thread pool."""
+    
+    def __init__(self, cache: DEMRenderCache, dem: np.ndarray, metadata: dict,
+                 product: str, max_size: Optional[int], generation: int):
+        super().__init__()
+        self.cache = cache
+        self.dem = dem
+        self.metadata = metadata
+        self.product = product
+        self.max_size = max_size
+        self.generation = generation
+        self.signals = RenderSignals()
+    
+    def run(self):
+        data = self.cache.get(self.dem, self.metadata, self.product, self.max_size, self.generation)
+        self.signals.finished.emit(self.generation, self.product, data)
+
+class ReconstructionSignals(QObject):
+    """Signals emitted by ReconstructionWorker."""
+    stage_changed = pyqtSignal(str, float)
+    product_ready = pyqtSignal(str, object)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+class ReconstructionWorker(QRunnable):
+    """Runs AerialReconstructor.process_images off the GUI thread.
+
+    Stage changes and intermediate products (sparse model, dense and
+    filtered clouds, DEM) are forwarded as Qt signals, which are delivered
+    on the GUI thread; cancel() stops the run at the next stage boundary or
+    COLMAP output line.
+    """
+    
+    def __init__(self, reconstructor: "AerialReconstructor", image1_path: str, image2_path: str):
+        super().__init__()
+        self.reconstructor = reconstructor
+        self.image1_path = image1_path
+        self.image2_path = image2_path
+        self.cancel_event = threading.Event()
+        self.signals = ReconstructionSignals()
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def run(self):
+        try:
+            result = self.reconstructor.process_images(
+                self.image1_path, self.image2_path,
+                stage_callback=self.signals.stage_changed.emit,
+                product_callback=self.signals.product_ready.emit,
+                cancel_event=self.cancel_event
+            )
+            self.signals.finished.emit(result)
+        except ReconstructionCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+
 class VisualizationTab(QWidget):
     """Extended visualization tab for the GUI."""
     
@@ -289,32 +554,66 @@ class VisualizationTab(QWidget):
         self.dem_data = None
         self.metadata = None
         
+        # Products are cached per DEM and computed in the thread pool
+        self.render_cache = DEMRenderCache()
+        self.thread_pool = QThreadPool.globalInstance()
+        self.generation = self.render_cache.generation
+        self.pending_tasks = []
+        
     def set_data(self, dem: np.ndarray, metadata: dict):
         """Set the DEM data and update visualization."""
         self.dem_data = dem
         self.metadata = metadata
+        self.generation = self.render_cache.reset()
         self.update_visualization()
         
+    def screen_size(self) -> int:
+        """Largest DEM side worth rendering interactively: the canvas size in pixels."""
+        return max(self.canvas.width(), self.canvas.height(), 256)
+        
     def update_visualization(self):
         """Update the current visualization."""
         if self.dem_data is None:
             return
             
+        vis_type = self.vis_combo.currentText()
+        max_size = self.screen_size()
+        data = self.render_cache.lookup(vis_type, max_size, self.generation)
+        if data is not None:
+            self.draw_product(vis_type, data)
+            return
+        
+        self.figure.clear()
+        self.figure.suptitle(f'Rendering {vis_type}...')
+        self.canvas.draw()
+        
+        task = RenderTask(self.render_cache, self.dem_data, self.metadata, vis_type, max_size, self.generation)
+        task.signals.finished.connect(self._render_finished)
+        # Keep a reference so the signals object outlives the runnable
+        self.pending_tasks.append(task)
+        self.thread_pool.start(task)
+        
+    def _render_finished(self, generation: int, vis_type: str, data: dict):
+        self.pending_tasks = [t for t in self.pending_tasks if t.product != vis_type or t.generation != generation]
+        # Drop results for an older DEM or a type the user has moved away from
+        if generation == self.generation and vis_type == self.vis_combo.currentText():
+            self.draw_product(vis_type, data)
+        
+    def draw_product(self, vis_type: str, data: dict):
+        """Draw a precomputed product on the figure (GUI thread)."""
         self.figure.clear()
         
-        vis_type = self.vis_combo.currentText()
         if vis_type == 'Shaded Relief':
-            shaded = DEMVisualizer.create_shaded_relief(self.dem_data, self.metadata)
             ax = self.figure.add_subplot(111)
-            im = ax.imshow(shaded, cmap='gist_earth')
+            im = ax.imshow(data['image'], cmap='gist_earth')
             self.figure.colorbar(im, label='Elevation (m)')
             ax.set_title('Shaded Relief Map')
             
         elif vis_type == 'Contour Map':
-            DEMVisualizer.create_contour_plot(self.figure, self.dem_data, self.metadata)
+            DEMVisualizer.create_contour_plot(self.figure, data['dem'], data['levels'])
             
         elif vis_type == '3D Surface':
-            DEMVisualizer.create_3d_plot(self.figure, self.dem_data, self.metadata)
+            DEMVisualizer.create_3d_plot(self.figure, data['X'], data['Y'], data['Z'])
         
         self.canvas.draw()
         
@@ -331,7 +630,12 @@ class VisualizationTab(QWidget):
         )
         
         if file_path:
+            # Exports use the full-resolution DEM, then the interactive view is restored
+            vis_type = self.vis_combo.currentText()
+            self.draw_product(vis_type, self.render_cache.get(self.dem_data, self.metadata, vis_type, None,
+                                                               self.generation))
             self.figure.savefig(file_path, dpi=300, bbox_inches='tight')
+            self.update_visualization()
             QMessageBox.information(self, "Success", "Visualization exported successfully!")
 
 # Update the main window to include the new visualization tab
@@ -345,11 +649,52 @@ class MainWindow(QMainWindow):
         
         # ... (rest of the UI setup code) ...
         
+    def start_reconstruction(self, image1_path: str, image2_path: str):
+        """Run the reconstruction in the thread pool, keeping the UI responsive."""
+        if getattr(self, "worker", None) is not None:
+            return
+        
+        self.worker = ReconstructionWorker(AerialReconstructor(self.config), image1_path, image2_path)
+        self.worker.signals.stage_changed.connect(self._stage_changed)
+        self.worker.signals.product_ready.connect(self._product_ready)
+        self.worker.signals.finished.connect(self._process_complete)
+        self.worker.signals.failed.connect(self._process_failed)
+        self.worker.signals.cancelled.connect(self._process_cancelled)
+        QThreadPool.globalInstance().start(self.worker)
+        
+    def cancel_reconstruction(self):
+        if getattr(self, "worker", None) is not None:
+            self.worker.cancel()
+            self.statusBar().showMessage("Cancelling...")
+        
+    def _stage_changed(self, stage: str, fraction: float):
+        self.statusBar().showMessage(f"Running {stage.replace('_', ' ')}...")
+        if hasattr(self, "progress_bar"):
+            self.progress_bar.setValue(int(fraction * 100))
+        
+    def _product_ready(self, name: str, product: object):
+        # Early results can be inspected while later stages run
+        if name == "dem":
+            dem, metadata = product
+            self.vis_tab.set_data(dem, metadata)
+        elif name in ("dense_cloud", "filtered_cloud"):
+            self.statusBar().showMessage(f"{name.replace('_', ' ').capitalize()} ready: {len(product):,} points")
+        elif name == "sparse_model":
+            self.statusBar().showMessage(f"Sparse model ready: {product}")
+        
     def _process_complete(self, result: Tuple[np.ndarray, dict]):
         # ... (previous completion code) ...
+        self.worker = None
+        # The visualization tab already received this DEM through product_ready
+        self.statusBar().showMessage("Reconstruction complete")
+        
+    def _process_failed(self, message: str):
+        self.worker = None
+        QMessageBox.critical(self, "Reconstruction failed", message)
         
-        # Update visualization tab
-        self.vis_tab.set_data(dem, metadata)
+    def _process_cancelled(self):
+        self.worker = None
+        self.statusBar().showMessage("Reconstruction cancelled")
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
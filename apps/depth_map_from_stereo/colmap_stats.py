@@ -0,0 +1,138 @@
+# Save as colmap_stats.py
+import sqlite3
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Optional
+from ply_stream import read_ply_header
+
+# COLMAP packs an image pair into one id: pair_id = id1 * MAX_IMAGE_ID + id2
+MAX_IMAGE_ID = 2147483647
+
+def _distribution(values: List[int]) -> Dict[str, float]:
+    if not values:
+        return {"min": 0, "median": 0, "mean": 0, "max": 0}
+    array = np.asarray(values)
+    return {
+        "min": int(array.min()),
+        "median": float(np.median(array)),
+        "mean": float(array.mean()),
+        "max": int(array.max())
+    }
+
+def _connect(database_path: Path) -> sqlite3.Connection:
+    """Read-only connection, so stats never lock a database COLMAP is writing."""
+    return sqlite3.connect(f"file:{Path(database_path).as_posix()}?mode=ro", uri=True)
+
+def _per_image_matches(cur: sqlite3.Cursor, table: str) -> Dict[int, int]:
+    """Match count per image id, summed over every pair the image is part of."""
+    cur.execute(f"""
+        SELECT image_id, SUM(rows) FROM (
+            SELECT pair_id / {MAX_IMAGE_ID} AS image_id, rows FROM {table}
+            UNION ALL
+            SELECT pair_id % {MAX_IMAGE_ID} AS image_id, rows FROM {table}
+        ) GROUP BY image_id
+    """)
+    return {image_id: int(count) for image_id, count in cur.fetchall()}
+
+def database_stats(database_path: Path) -> Dict:
+    """Keypoint and match statistics from a COLMAP database.
+
+    Each keypoints/matches row stores its element count in the `rows`
+    column next to the BLOB, so the totals are SUM(rows) and no BLOB is
+    ever read.
+    """
+    with _connect(database_path) as conn:
+        cur = conn.cursor()
+
+        cur.execute("SELECT COUNT(*) FROM images")
+        total_images = cur.fetchone()[0]
+
+        cur.execute("""
+            SELECT images.image_id, images.name, COALESCE(keypoints.rows, 0)
+            FROM images LEFT JOIN keypoints ON keypoints.image_id = images.image_id
+        """)
+        images = cur.fetchall()
+
+        cur.execute("SELECT COUNT(*), COALESCE(SUM(rows), 0) FROM matches")
+        matched_pairs, total_matches = cur.fetchone()
+        matches_per_image = _per_image_matches(cur, "matches")
+
+        # Geometrically verified matches only exist after matching with verification
+        cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'two_view_geometries'")
+        if cur.fetchone()[0]:
+            cur.execute("SELECT COUNT(*), COALESCE(SUM(rows), 0) FROM two_view_geometries WHERE rows > 0")
+            verified_pairs, verified_matches = cur.fetchone()
+        else:
+            verified_pairs, verified_matches = 0, 0
+
+    per_image = [
+        {"name": name, "keypoints": int(keypoints), "matches": matches_per_image.get(image_id, 0)}
+        for image_id, name, keypoints in images
+    ]
+    return {
+        "total_images": total_images,
+        "total_keypoints": int(sum(image["keypoints"] for image in per_image)),
+        "total_matches": int(total_matches),
+        "matched_pairs": matched_pairs,
+        "verified_matches": int(verified_matches),
+        "verified_pairs": verified_pairs,
+        "keypoints_per_image": _distribution([image["keypoints"] for image in per_image]),
+        "matches_per_image": _distribution([image["matches"] for image in per_image]),
+        "per_image": per_image
+    }
+
+def dense_point_count(ply_path: Path) -> Optional[int]:
+    """Vertex count of a PLY file read from its header alone."""
+    if not Path(ply_path).exists():
+        return None
+    for element in read_ply_header(ply_path)["elements"]:
+        if element["name"] == "vertex":
+            return element["count"]
+    return 0
+
+def reconstruction_stats(workspace: Path) -> Dict:
+    """Database and dense cloud statistics for a reconstruction workspace."""
+    workspace = Path(workspace)
+    stats = database_stats(workspace / "database.db")
+    points = dense_point_count(workspace / "dense" / "fused.ply")
+    if points is not None:
+        stats["dense_points"] = points
+    return stats
+
+def has_position_priors(database_path: Path) -> bool:
+    """Whether any image in a COLMAP database carries a position prior (e.g. EXIF GPS).
+
+    Newer COLMAP versions keep priors in a pose_priors table, older ones in
+    the prior_tx/ty/tz columns of images (NULL or NaN when absent).
+    """
+    if not Path(database_path).exists():
+        return False
+    with _connect(database_path) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tables = {row[0] for row in cur.fetchall()}
+        if "pose_priors" in tables:
+            cur.execute("SELECT COUNT(*) FROM pose_priors")
+            if cur.fetchone()[0]:
+                return True
+        if "images" in tables:
+            cur.execute("PRAGMA table_info(images)")
+            if "prior_tx" in {row[1] for row in cur.fetchall()}:
+                # NaN != NaN, so the comparison also drops NaN priors
+                cur.execute("SELECT COUNT(*) FROM images WHERE prior_tx = prior_tx AND prior_ty = prior_ty")
+                return cur.fetchone()[0] > 0
+    return False
+
+def resolve_matcher(matcher: str, num_images: int, database_path: Path, exhaustive_limit: int = 20) -> str:
+    """Concrete COLMAP matcher for a request of "auto", "exhaustive", "sequential" or "spatial".
+
+    "auto" matches exhaustively up to exhaustive_limit images and beyond
+    that uses spatial matching when the database holds position priors,
+    sequential (name order) matching otherwise. Spatial matching without
+    priors finds no pairs, so an explicit "spatial" falls back the same way.
+    """
+    if matcher == "auto":
+        matcher = "exhaustive" if num_images <= exhaustive_limit else "spatial"
+    if matcher == "spatial" and not has_position_priors(database_path):
+        return "sequential"
+    return matcher
@@ -0,0 +1,142 @@
+# Save as dem_binning.py
+import numpy as np
+from typing import Tuple
+
+REDUCERS = ("mean", "min", "max", "median")
+
+def grid_shape(x_min: float, x_max: float, y_min: float, y_max: float, grid_size: float) -> Tuple[int, int]:
+    """Number of (rows, cols) of a DEM grid covering the given bounds."""
+    x_grid = np.arange(x_min, x_max + grid_size, grid_size)
+    y_grid = np.arange(y_min, y_max + grid_size, grid_size)
+    return len(y_grid), len(x_grid)
+
+def cell_indices(points: np.ndarray, x_min: float, y_min: float, grid_size: float,
+                 shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Flattened DEM cell index of every point inside the grid, and the inside mask."""
+    # Truncation toward zero, like int() on each point
+    x_idx = ((points[:, 0] - x_min) / grid_size).astype(np.int64)
+    y_idx = ((points[:, 1] - y_min) / grid_size).astype(np.int64)
+    valid = (x_idx >= 0) & (x_idx < shape[1]) & (y_idx >= 0) & (y_idx < shape[0])
+    return y_idx[valid] * shape[1] + x_idx[valid], valid
+
+def bin_points(points: np.ndarray, x_min: float, y_min: float, grid_size: float,
+               shape: Tuple[int, int], reducer: str = "mean") -> Tuple[np.ndarray, np.ndarray]:
+    """Reduce point heights into DEM cells.
+
+    Returns the DEM (0 in empty cells) and the mask of cells that received
+    at least one point. The mean is accumulated with np.bincount in point
+    order, so it matches a per-point Python loop exactly; min, max and
+    median sort points by (cell, height) once and read each cell's slice.
+    """
+    if reducer not in REDUCERS:
+        raise ValueError(f"Unknown reducer '{reducer}', expected one of {REDUCERS}")
+
+    num_cells = shape[0] * shape[1]
+    flat_idx, valid = cell_indices(points, x_min, y_min, grid_size, shape)
+    z = points[valid, 2]
+
+    counts = np.bincount(flat_idx, minlength=num_cells)
+    mask = counts > 0
+
+    if reducer == "mean":
+        dem = np.bincount(flat_idx, weights=z, minlength=num_cells)
+        dem[mask] /= counts[mask]
+        return dem.reshape(shape), mask.reshape(shape)
+
+    order = np.lexsort((z, flat_idx))
+    z_sorted = z[order].astype(np.float64)
+    occupied = np.flatnonzero(mask)
+    starts = np.concatenate(([0], np.cumsum(counts[occupied])[:-1]))
+    ends = starts + counts[occupied]
+
+    dem = np.zeros(num_cells, dtype=np.float64)
+    if reducer == "min":
+        dem[occupied] = z_sorted[starts]
+    elif reducer == "max":
+        dem[occupied] = z_sorted[ends - 1]
+    else:
+        lower = starts + (counts[occupied] - 1) // 2
+        upper = starts + counts[occupied] // 2
+        dem[occupied] = (z_sorted[lower] + z_sorted[upper]) / 2
+
+    return dem.reshape(shape), mask.reshape(shape)
+
+def bin_points_chunked(points: np.ndarray, x_min: float, y_min: float, grid_size: float,
+                       shape: Tuple[int, int], chunk_size: int = 1 << 20) -> Tuple[np.ndarray, np.ndarray]:
+    """Mean DEM binning with one np.bincount pair per chunk of points.
+
+    Only one sum/count grid is kept and the per-point index arrays exist
+    for a single chunk at a time, so temporary memory is bounded by
+    chunk_size rather than the cloud size. Index arithmetic stays in the
+    cloud's dtype (float32 for PLY clouds) and sums are float64. With a
+    single chunk the result equals bin_points exactly; with several, each
+    cell's sum is formed per chunk and then added, which can differ from
+    bin_points in the last bits.
+    """
+    num_cells = shape[0] * shape[1]
+    dem = np.zeros(num_cells, dtype=np.float64)
+    counts = np.zeros(num_cells, dtype=np.int64)
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size]
+        flat_idx, valid = cell_indices(chunk, x_min, y_min, grid_size, shape)
+        dem += np.bincount(flat_idx, weights=chunk[valid, 2], minlength=num_cells)
+        counts += np.bincount(flat_idx, minlength=num_cells)
+
+    mask = counts > 0
+    dem[mask] /= counts[mask]
+    return dem.reshape(shape), mask.reshape(shape)
+
+class DEMAccumulator:
+    """Out-of-core DEM accumulation over chunks of a point cloud.
+
+    Keeps only per-cell running state (sum and count, or the running
+    min/max), so the cloud can be streamed chunk by chunk. The median needs
+    every height of a cell at once and is not supported here.
+
+    Min and max equal bin_points exactly. The mean does too while the cloud
+    fits in one chunk; beyond that each chunk's per-cell sum is formed with
+    np.bincount and then added to the running sum, which can round
+    differently from one sum over all points (last-bit differences). This is
+    deliberate: np.add.at would keep the point-order sum exact across chunks
+    but is about ten times slower than bincount.
+    """
+
+    def __init__(self, x_min: float, y_min: float, grid_size: float, shape: Tuple[int, int],
+                 reducer: str = "mean"):
+        if reducer not in ("mean", "min", "max"):
+            raise ValueError(f"Reducer '{reducer}' cannot be accumulated in chunks")
+        self.x_min = x_min
+        self.y_min = y_min
+        self.grid_size = grid_size
+        self.shape = shape
+        self.reducer = reducer
+
+        num_cells = shape[0] * shape[1]
+        self.counts = np.zeros(num_cells, dtype=np.int64)
+        self.values = np.zeros(num_cells, dtype=np.float64)
+
+    def add(self, points: np.ndarray) -> None:
+        """Fold one chunk of points into the grid."""
+        num_cells = self.counts.size
+        if self.reducer == "mean":
+            flat_idx, valid = cell_indices(points, self.x_min, self.y_min, self.grid_size, self.shape)
+            self.counts += np.bincount(flat_idx, minlength=num_cells)
+            self.values += np.bincount(flat_idx, weights=points[valid, 2], minlength=num_cells)
+            return
+
+        dem, mask = bin_points(points, self.x_min, self.y_min, self.grid_size, self.shape, self.reducer)
+        dem, mask = dem.reshape(-1), mask.reshape(-1)
+        seen = mask & (self.counts > 0)
+        first = mask & (self.counts == 0)
+        combine = np.minimum if self.reducer == "min" else np.maximum
+        self.values[seen] = combine(self.values[seen], dem[seen])
+        self.values[first] = dem[first]
+        self.counts += mask
+
+    def result(self) -> Tuple[np.ndarray, np.ndarray]:
+        """DEM (0 in empty cells) and occupancy mask, as returned by bin_points."""
+        mask = self.counts > 0
+        dem = self.values.copy()
+        if self.reducer == "mean":
+            dem[mask] /= self.counts[mask]
+        return dem.reshape(self.shape), mask.reshape(self.shape)
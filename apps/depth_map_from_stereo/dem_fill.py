@@ -0,0 +1,132 @@
+# Save as dem_fill.py
+import time
+import numpy as np
+from typing import Dict, Optional, Sequence
+from scipy.interpolate import griddata
+from scipy.ndimage import distance_transform_edt, zoom
+from scipy.spatial import cKDTree
+
+GRIDDATA_METHODS = ("linear", "cubic")
+FILL_METHODS = GRIDDATA_METHODS + ("nearest", "pyramid", "idw")
+
+def _fill_griddata(dem: np.ndarray, mask: np.ndarray, method: str) -> np.ndarray:
+    """Delaunay interpolation over every known cell (the original behaviour)."""
+    y_coords, x_coords = np.where(mask)
+    yi, xi = np.where(~mask)
+    filled = dem.copy()
+    filled[~mask] = griddata(
+        np.column_stack([x_coords, y_coords]), dem[mask],
+        np.column_stack([xi, yi]), method=method
+    )
+    return filled
+
+def _fill_nearest(dem: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Copy the nearest known cell, found with one exact distance transform."""
+    _, (rows, cols) = distance_transform_edt(~mask, return_indices=True)
+    return dem[rows, cols]
+
+def _fill_pyramid(dem: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Pull-push inpainting: average known cells down a 2x pyramid, interpolate back up."""
+    values = np.where(mask, dem, 0.0)
+    weights = mask.astype(np.float64)
+    levels = [(values, weights)]
+
+    # Pull: sum 2x2 blocks of weighted values and weights
+    while min(values.shape) > 1:
+        h, w = values.shape
+        values = np.pad(values, ((0, h % 2), (0, w % 2)))
+        weights = np.pad(weights, ((0, h % 2), (0, w % 2)))
+        values = values.reshape(values.shape[0] // 2, 2, values.shape[1] // 2, 2).sum(axis=(1, 3))
+        weights = weights.reshape(weights.shape[0] // 2, 2, weights.shape[1] // 2, 2).sum(axis=(1, 3))
+        levels.append((values, weights))
+
+    # Push: keep each level's own averages, take the rest from the coarser level
+    values, weights = levels[-1]
+    filled = np.divide(values, weights, out=np.zeros_like(values), where=weights > 0)
+    for values, weights in reversed(levels[:-1]):
+        h, w = values.shape
+        upsampled = zoom(filled, 2, order=1, mode="nearest")
+        upsampled = np.pad(upsampled, ((0, max(h - upsampled.shape[0], 0)), (0, max(w - upsampled.shape[1], 0))),
+                           mode="edge")[:h, :w]
+        filled = np.where(weights > 0, values / np.maximum(weights, 1e-12), upsampled)
+
+    return np.where(mask, dem, filled)
+
+def _fill_idw(dem: np.ndarray, mask: np.ndarray, k: int = 8, radius: Optional[float] = None,
+              power: float = 2.0) -> np.ndarray:
+    """Inverse-distance weighting of the k nearest known cells within radius (KD-tree)."""
+    known = np.column_stack(np.where(mask))
+    unknown = np.column_stack(np.where(~mask))
+    k = min(k, len(known))
+    distances, indices = cKDTree(known).query(
+        unknown, k=k, distance_upper_bound=np.inf if radius is None else radius
+    )
+    distances = distances.reshape(len(unknown), k)
+    indices = indices.reshape(len(unknown), k)
+
+    # Missing neighbours come back with infinite distance and index len(known)
+    found = np.isfinite(distances)
+    values = np.append(dem[mask], np.nan)[indices]
+    weights = np.where(found, 1.0 / np.maximum(distances, 1e-12) ** power, 0.0)
+    total = weights.sum(axis=1)
+    estimates = np.full(len(unknown), np.nan)
+    has_neighbours = total > 0
+    estimates[has_neighbours] = (
+        np.nansum(weights * values, axis=1)[has_neighbours] / total[has_neighbours]
+    )
+
+    filled = dem.astype(np.float64).copy()
+    filled[~mask] = estimates
+    return filled
+
+def fill_gaps(dem: np.ndarray, mask: np.ndarray, method: str = "linear",
+              max_gap: Optional[float] = None, **kwargs) -> np.ndarray:
+    """Fill DEM cells outside `mask`.
+
+    `method` is "linear"/"cubic" (scipy griddata, O(n log n) Delaunay over
+    all known cells) or one of the linear-time strategies "nearest"
+    (distance transform), "pyramid" (pull-push multigrid) and "idw"
+    (KD-tree inverse distance; accepts k, radius and power). Cells further
+    than `max_gap` cells from any known cell are left as NaN.
+    """
+    if method not in FILL_METHODS:
+        raise ValueError(f"Unknown fill method '{method}', expected one of {FILL_METHODS}")
+    if mask.all() or not mask.any():
+        return dem
+
+    if method in GRIDDATA_METHODS:
+        filled = _fill_griddata(dem, mask, method)
+    elif method == "nearest":
+        filled = _fill_nearest(dem, mask)
+    elif method == "pyramid":
+        filled = _fill_pyramid(dem, mask)
+    else:
+        filled = _fill_idw(dem, mask, **kwargs)
+
+    if max_gap is not None:
+        filled = filled.astype(np.float64, copy=False)
+        filled[distance_transform_edt(~mask) > max_gap] = np.nan
+    return filled
+
+def benchmark(shape=(1000, 1000), coverage: float = 0.3,
+              methods: Sequence[str] = FILL_METHODS, seed: int = 0) -> Dict[str, Dict[str, float]]:
+    """Time each fill method on a synthetic sparse DEM and report RMSE against the truth."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:shape[0], 0:shape[1]] / max(shape)
+    truth = 50 * np.sin(3 * x) * np.cos(2 * y) + 20 * x
+    mask = rng.random(shape) < coverage
+    dem = np.where(mask, truth, 0.0)
+
+    results = {}
+    for method in methods:
+        start = time.perf_counter()
+        filled = fill_gaps(dem, mask, method)
+        elapsed = time.perf_counter() - start
+        valid = ~mask & np.isfinite(filled)
+        rmse = float(np.sqrt(np.mean((filled[valid] - truth[valid]) ** 2))) if valid.any() else float("nan")
+        results[method] = {"seconds": elapsed, "rmse": rmse}
+        print(f"{method:>8}: {elapsed:8.3f}s  rmse {rmse:.4f}")
+    return results
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,94 @@
+# Save as dem_mosaic.py
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+from scipy.ndimage import distance_transform_edt
+from dem_fill import fill_gaps
+
+Window = Tuple[int, int, int, int]
+
+def tile_windows(shape: Tuple[int, int], tile_size: int = 1024, overlap: int = 64) -> List[Window]:
+    """(row0, row1, col0, col1) of every tile: a tile_size core grown by `overlap` cells per side."""
+    windows = []
+    for row in range(0, shape[0], tile_size):
+        for col in range(0, shape[1], tile_size):
+            windows.append((
+                max(row - overlap, 0), min(row + tile_size + overlap, shape[0]),
+                max(col - overlap, 0), min(col + tile_size + overlap, shape[1])
+            ))
+    return windows
+
+def _ramp(length: int, start: int, stop: int, size: int, overlap: int) -> np.ndarray:
+    """1-D feather weights along one axis of a window; edges on the grid border keep full weight."""
+    position = np.arange(length) + 0.5
+    weight = np.ones(length)
+    if overlap > 0:
+        if start > 0:
+            weight = np.minimum(weight, position / (2 * overlap))
+        if stop < size:
+            weight = np.minimum(weight, (length - position) / (2 * overlap))
+    return weight
+
+def feather_weights(window: Window, shape: Tuple[int, int], overlap: int) -> np.ndarray:
+    """Blend weights of a tile; across a shared 2*overlap band the two tiles' weights sum to 1."""
+    row0, row1, col0, col1 = window
+    rows = _ramp(row1 - row0, row0, row1, shape[0], overlap)
+    cols = _ramp(col1 - col0, col0, col1, shape[1], overlap)
+    return np.outer(rows, cols)
+
+def mosaic(tiles: List[np.ndarray], windows: List[Window], shape: Tuple[int, int],
+           overlap: int) -> np.ndarray:
+    """Blend overlapping tiles into one grid with linear seam feathering.
+
+    NaN cells of a tile carry no weight, so a neighbour's values are used
+    where only one tile has data; cells no tile covers stay NaN.
+    """
+    total = np.zeros(shape)
+    weights = np.zeros(shape)
+    for tile, window in zip(tiles, windows):
+        row0, row1, col0, col1 = window
+        weight = feather_weights(window, shape, overlap)
+        valid = np.isfinite(tile)
+        weight = np.where(valid, weight, 0.0)
+        total[row0:row1, col0:col1] += np.where(valid, tile, 0.0) * weight
+        weights[row0:row1, col0:col1] += weight
+    return np.divide(total, weights, out=np.full(shape, np.nan), where=weights > 0)
+
+def _fill_tile(args) -> np.ndarray:
+    dem, mask, method, max_gap, kwargs = args
+    if not mask.any():
+        return np.full(dem.shape, np.nan)
+    return fill_gaps(dem, mask, method, max_gap, **kwargs).astype(np.float64, copy=False)
+
+def fill_gaps_tiled(dem: np.ndarray, mask: np.ndarray, method: str = "linear",
+                    max_gap: Optional[float] = None, tile_size: int = 1024, overlap: int = 64,
+                    workers: Optional[int] = None, **kwargs) -> np.ndarray:
+    """fill_gaps over overlapping tiles in a process pool, mosaicked with feathered seams.
+
+    Meant for block-sized DEMs where one global interpolation is the
+    bottleneck. Each tile sees `overlap` cells of context past its core.
+    Tiles without any data are skipped; cells the tiles leave empty (such
+    tiles, or outside a tile's interpolation hull) take the nearest filled
+    value, and max_gap is then applied to the whole grid, so empty areas of
+    a block never leave NaN unless max_gap asks for it.
+    """
+    if mask.all() or not mask.any():
+        return dem
+    windows = tile_windows(dem.shape, tile_size, overlap)
+    jobs = [
+        (dem[row0:row1, col0:col1], mask[row0:row1, col0:col1], method, max_gap, kwargs)
+        for row0, row1, col0, col1 in windows
+    ]
+    if workers == 1 or len(jobs) == 1:
+        tiles = [_fill_tile(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tiles = list(executor.map(_fill_tile, jobs))
+    filled = mosaic(tiles, windows, dem.shape, overlap)
+    
+    holes = np.isnan(filled)
+    if holes.any():
+        filled = fill_gaps(filled, ~holes, "nearest")
+        if max_gap is not None:
+            filled[distance_transform_edt(~mask) > max_gap] = np.nan
+    return filled
@@ -0,0 +1,111 @@
+# Save as dem_tiles.py
+import json
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Optional
+
+def _downsample(level: np.ndarray) -> np.ndarray:
+    """Halve a DEM level by averaging 2x2 blocks, ignoring NaN cells."""
+    h, w = level.shape
+    padded = np.pad(level, ((0, h % 2), (0, w % 2)), constant_values=np.nan)
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    valid = np.isfinite(blocks)
+    counts = valid.sum(axis=(1, 3))
+    sums = np.where(valid, blocks, 0.0).sum(axis=(1, 3))
+    return np.divide(sums, counts, out=np.full(counts.shape, np.nan), where=counts > 0).astype(level.dtype)
+
+def write_tiled_dem(dem: np.ndarray, output_dir: Path, tile_size: int = 256,
+                    min_overview: int = 256) -> Dict:
+    """Write a DEM as fixed-size .npy tiles plus 2x overview levels.
+
+    Layout: output_dir/level_<n>/tile_<row>_<col>.npy, where level 0 is full
+    resolution and each further level halves it until the level fits in
+    `min_overview` cells. Returns the description stored under "tiles" in
+    metadata.json; it records which tiles contain NaN so readers never need
+    to scan the grid.
+    """
+    output_dir = Path(output_dir)
+    levels: List[Dict] = []
+    level_data = np.asarray(dem, dtype=np.float32)
+    level = 0
+
+    while True:
+        level_dir = output_dir / f"level_{level}"
+        level_dir.mkdir(parents=True, exist_ok=True)
+        rows = -(-level_data.shape[0] // tile_size)
+        cols = -(-level_data.shape[1] // tile_size)
+        nodata_tiles = []
+
+        for row in range(rows):
+            for col in range(cols):
+                tile = level_data[row * tile_size:(row + 1) * tile_size,
+                                  col * tile_size:(col + 1) * tile_size]
+                np.save(level_dir / f"tile_{row}_{col}.npy", tile)
+                if np.isnan(tile).any():
+                    nodata_tiles.append([row, col])
+
+        levels.append({
+            "level": level,
+            "scale": 2 ** level,
+            "shape": list(level_data.shape),
+            "rows": rows,
+            "cols": cols,
+            "nodata_tiles": nodata_tiles
+        })
+
+        if max(level_data.shape) <= min_overview:
+            break
+        level_data = _downsample(level_data)
+        level += 1
+
+    return {
+        "format": "npy-tiles",
+        "tile_size": tile_size,
+        "dtype": "float32",
+        "has_nodata": bool(levels[0]["nodata_tiles"]),
+        "levels": levels
+    }
+
+class TiledDEM:
+    """Window and overview reader for a DEM written by write_tiled_dem."""
+
+    def __init__(self, tiles_dir: Path, tiles_metadata: Optional[Dict] = None):
+        self.tiles_dir = Path(tiles_dir)
+        if tiles_metadata is None:
+            with open(self.tiles_dir.parent / "metadata.json") as f:
+                tiles_metadata = json.load(f)["tiles"]
+        self.tile_size = tiles_metadata["tile_size"]
+        self.levels = tiles_metadata["levels"]
+
+    def shape(self, level: int = 0) -> tuple:
+        return tuple(self.levels[level]["shape"])
+
+    def best_level(self, max_size: int) -> int:
+        """Finest level whose larger side fits within max_size cells."""
+        for info in self.levels:
+            if max(info["shape"]) <= max_size:
+                return info["level"]
+        return self.levels[-1]["level"]
+
+    def read_window(self, row0: int, row1: int, col0: int, col1: int, level: int = 0) -> np.ndarray:
+        """Read rows [row0, row1) and cols [col0, col1) of a level, loading only the tiles it touches."""
+        height, width = self.shape(level)
+        row0, row1 = max(row0, 0), min(row1, height)
+        col0, col1 = max(col0, 0), min(col1, width)
+        window = np.full((max(row1 - row0, 0), max(col1 - col0, 0)), np.nan, dtype=np.float32)
+        size = self.tile_size
+
+        for row in range(row0 // size, -(-row1 // size)):
+            for col in range(col0 // size, -(-col1 // size)):
+                tile = np.load(self.tiles_dir / f"level_{level}" / f"tile_{row}_{col}.npy", mmap_mode="r")
+                r0, c0 = row * size, col * size
+                rs, re = max(row0, r0), min(row1, r0 + tile.shape[0])
+                cs, ce = max(col0, c0), min(col1, c0 + tile.shape[1])
+                window[rs - row0:re - row0, cs - col0:ce - col0] = tile[rs - r0:re - r0, cs - c0:ce - c0]
+
+        return window
+
+    def read_level(self, level: int) -> np.ndarray:
+        """Whole overview level; meant for the coarse levels."""
+        height, width = self.shape(level)
+        return self.read_window(0, height, 0, width, level)
@@ -6,6 +6,13 @@ import cv2
 from pathlib import Path
 import json
 import shutil
+import argparse
+from dem_binning import DEMAccumulator, bin_points, grid_shape
+from ply_stream import iter_ply_chunks, ply_bounds, read_ply_points
+from dem_fill import fill_gaps
+from dem_mosaic import fill_gaps_tiled
+from colmap_stats import resolve_matcher
+from colmap_common import MATCHERS, collect_images, matcher_command
 
 class AerialReconstructor:
     def __init__(self, workspace_path="./reconstruction"):
@@ -25,11 +32,21 @@ class AerialReconstructor:
         for dir_path in dirs:
             dir_path.mkdir(parents=True, exist_ok=True)
 
-    def _copy_images(self, image1_path, image2_path):
-        """Copy input images to the workspace."""
+    def _copy_images(self, image_paths):
+        """Copy input images to the workspace as image1, image2, ...
+
+        Images left over from a previous, different set are removed so COLMAP
+        only sees the current block.
+        """
         # Copy and rename images to ensure consistent naming
-        shutil.copy2(image1_path, self.image_path / "image1.jpg")
-        shutil.copy2(image2_path, self.image_path / "image2.jpg")
+        names = set()
+        for index, image_path in enumerate(image_paths, start=1):
+            name = f"image{index}{Path(image_path).suffix.lower()}"
+            shutil.copy2(image_path, self.image_path / name)
+            names.add(name)
+        for stale in self.image_path.iterdir():
+            if stale.is_file() and stale.name not in names:
+                stale.unlink()
 
     def _run_colmap_feature_extractor(self):
         """Extract features from images using COLMAP."""
@@ -42,14 +59,23 @@ class AerialReconstructor:
         ]
         subprocess.run(cmd, check=True)
 
-    def _run_colmap_matcher(self):
-        """Match features between images using COLMAP."""
-        cmd = [
-            "colmap", "exhaustive_matcher",
-            "--database_path", str(self.database_path),
-            "--SiftMatching.use_gpu", "1"
-        ]
+    def _run_colmap_matcher(self, matcher="exhaustive", max_neighbors=20):
+        """Match features between images using COLMAP; returns the matcher used.
+
+        "exhaustive" matches every pair and is meant for small sets. For a
+        sortie, "spatial" only matches each image with its `max_neighbors`
+        nearest neighbours by EXIF GPS position, and "sequential" with the
+        next images in file order. Without GPS priors in the database
+        "spatial" falls back to "sequential"; "auto" is exhaustive for small
+        sets (see colmap_stats.resolve_matcher).
+        """
+        if matcher not in MATCHERS:
+            raise ValueError(f"Unknown matcher '{matcher}', expected one of {MATCHERS}")
+        num_images = sum(1 for p in self.image_path.iterdir() if p.is_file())
+        matcher = resolve_matcher(matcher, num_images, self.database_path)
+        cmd = matcher_command(matcher, self.database_path, max_neighbors, ["--SiftMatching.use_gpu", "1"])
         subprocess.run(cmd, check=True)
+        return matcher
 
     def _run_colmap_mapper(self):
         """Run the COLMAP mapper to create sparse reconstruction."""
@@ -91,55 +117,43 @@ class AerialReconstructor:
         ]
         subprocess.run(cmd_fusion, check=True)
 
-    def _generate_dem(self):
-        """Convert dense point cloud to DEM."""
-        # Read the PLY file
-        from plyfile import PlyData
-        ply_data = PlyData.read(str(self.dense_path / "fused.ply"))
-        
-        # Extract points and create grid
-        points = np.vstack([
-            ply_data['vertex']['x'],
-            ply_data['vertex']['y'],
-            ply_data['vertex']['z']
-        ]).T
+    def _generate_dem(self, reducer="mean", chunk_size=1_000_000, fill_method="linear", max_gap=None,
+                      tile_size=None, workers=None):
+        """Convert dense point cloud to DEM, reducing each cell's heights with `reducer`.
+
+        The fused cloud is streamed from a memory map in chunks of
+        `chunk_size` points, so it never has to fit in RAM; the median
+        reducer is the exception and loads every point. For clouds larger
+        than one chunk the mean can differ from an in-memory bin_points in
+        the last bits (see dem_binning.DEMAccumulator). Empty cells are
+        filled with `fill_method` (see dem_fill.fill_gaps); cells more than
+        `max_gap` cells from data stay NaN. With `tile_size` the fill runs
+        per tile on `workers` processes and the tiles are mosaicked with
+        feathered seams (see dem_mosaic.fill_gaps_tiled).
+        """
+        ply_path = self.dense_path / "fused.ply"
         
         # Create a regular grid
         grid_size = 1.0  # 1 meter grid cells
-        x_min, x_max = points[:, 0].min(), points[:, 0].max()
-        y_min, y_max = points[:, 1].min(), points[:, 1].max()
-        
-        x_grid = np.arange(x_min, x_max + grid_size, grid_size)
-        y_grid = np.arange(y_min, y_max + grid_size, grid_size)
+        lower, upper = ply_bounds(ply_path, chunk_size)
+        x_min, x_max = lower[0], upper[0]
+        y_min, y_max = lower[1], upper[1]
         
-        # Initialize DEM grid
-        dem = np.zeros((len(y_grid), len(x_grid)))
-        dem_count = np.zeros_like(dem)
-        
-        # Fill DEM grid
-        for point in points:
-            x_idx = int((point[0] - x_min) / grid_size)
-            y_idx = int((point[1] - y_min) / grid_size)
-            if 0 <= x_idx < dem.shape[1] and 0 <= y_idx < dem.shape[0]:
-                dem[y_idx, x_idx] += point[2]
-                dem_count[y_idx, x_idx] += 1
-        
-        # Average heights and handle empty cells
-        mask = dem_count > 0
-        dem[mask] /= dem_count[mask]
+        # Fill DEM grid; empty cells are left at 0 and flagged in mask
+        shape = grid_shape(x_min, x_max, y_min, y_max, grid_size)
+        if reducer == "median":
+            dem, mask = bin_points(read_ply_points(ply_path, chunk_size), x_min, y_min, grid_size, shape, reducer)
+        else:
+            accumulator = DEMAccumulator(x_min, y_min, grid_size, shape, reducer)
+            for chunk in iter_ply_chunks(ply_path, chunk_size):
+                accumulator.add(chunk)
+            dem, mask = accumulator.result()
         
         # Interpolate empty cells
-        from scipy.interpolate import griddata
-        y_coords, x_coords = np.where(mask)
-        values = dem[mask]
-        
-        yi, xi = np.where(~mask)
-        points_known = np.column_stack([x_coords, y_coords])
-        points_unknown = np.column_stack([xi, yi])
-        
-        if len(points_unknown) > 0:
-            interpolated = griddata(points_known, values, points_unknown, method='linear')
-            dem[~mask] = interpolated
+        if tile_size:
+            dem = fill_gaps_tiled(dem, mask, fill_method, max_gap, tile_size=tile_size, workers=workers)
+        else:
+            dem = fill_gaps(dem, mask, fill_method, max_gap)
         
         # Save DEM
         np.save(str(self.workspace / "dem.npy"), dem)
@@ -150,25 +164,44 @@ class AerialReconstructor:
             "x_max": float(x_max),
             "y_min": float(y_min),
             "y_max": float(y_max),
-            "grid_size": float(grid_size)
+            "grid_size": float(grid_size),
+            "reducer": reducer,
+            "fill_method": fill_method,
+            "max_gap": max_gap,
+            "tile_size": tile_size
         }
         with open(str(self.workspace / "dem_metadata.json"), "w") as f:
             json.dump(metadata, f)
         
         return dem, metadata
 
-    def process_images(self, image1_path, image2_path):
+    def process_images(self, image1_path, image2_path, reducer="mean", fill_method="linear", max_gap=None):
         """Process two aerial images to create a DEM."""
+        return self.process_block([image1_path, image2_path], matcher="exhaustive", reducer=reducer,
+                                  fill_method=fill_method, max_gap=max_gap, tile_size=None)
+
+    def process_block(self, images, matcher="auto", max_neighbors=20, reducer="mean",
+                      fill_method="linear", max_gap=None, tile_size=1024, workers=None):
+        """Process an overlapping block of aerial images (directory or list) into one merged DEM.
+
+        COLMAP reconstructs the whole block at once with `matcher` (see
+        _run_colmap_matcher); the DEM gap fill then runs per tile in parallel
+        and the tiles are feathered together.
+        """
+        image_paths = collect_images(images)
+        if len(image_paths) < 2:
+            raise ValueError(f"Need at least two images, found {len(image_paths)}")
         try:
             # Copy images to workspace
-            self._copy_images(image1_path, image2_path)
+            self._copy_images(image_paths)
             
             # Run COLMAP pipeline
-            print("Extracting features...")
+            print(f"Extracting features from {len(image_paths)} images...")
             self._run_colmap_feature_extractor()
             
             print("Matching features...")
-            self._run_colmap_matcher()
+            used = self._run_colmap_matcher(matcher, max_neighbors)
+            print(f"Matched with the {used} matcher")
             
             print("Creating sparse reconstruction...")
             self._run_colmap_mapper()
@@ -177,7 +210,9 @@ class AerialReconstructor:
             self._run_colmap_dense()
             
             print("Generating DEM...")
-            dem, metadata = self._generate_dem()
+            dem, metadata = self._generate_dem(reducer, fill_method=fill_method, max_gap=max_gap,
+                                               tile_size=tile_size, workers=workers)
+            metadata["num_images"] = len(image_paths)
             
             print(f"Reconstruction complete. Results saved in {self.workspace}")
             return dem, metadata
@@ -190,22 +225,32 @@ class AerialReconstructor:
             raise
 
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python script.py aerial_photo_1 aerial_photo_2")
-        sys.exit(1)
-    
-    image1_path = sys.argv[1]
-    image2_path = sys.argv[2]
+    parser = argparse.ArgumentParser(description="Build a DEM from two aerial photos or a whole block of them.")
+    parser.add_argument("images", nargs="+", help="two aerial photos, a list of photos, or one directory")
+    parser.add_argument("--workspace", default="./reconstruction")
+    parser.add_argument("--matcher", choices=MATCHERS, default="auto",
+                        help="matcher for blocks of more than two images; spatial needs GPS EXIF")
+    parser.add_argument("--max-neighbors", type=int, default=20)
+    parser.add_argument("--tile-size", type=int, default=1024, help="DEM fill tile size in cells for blocks")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
     
     # Check if images exist
-    if not os.path.exists(image1_path) or not os.path.exists(image2_path):
-        print("One or both input images do not exist!")
+    missing = [p for p in args.images if not os.path.exists(p)]
+    if missing:
+        print(f"Input images do not exist: {', '.join(missing)}")
         sys.exit(1)
     
     # Create reconstructor and process images
-    reconstructor = AerialReconstructor()
+    reconstructor = AerialReconstructor(args.workspace)
     try:
-        dem, metadata = reconstructor.process_images(image1_path, image2_path)
+        image_paths = collect_images(args.images[0] if len(args.images) == 1 else args.images)
+        if len(image_paths) == 2:
+            dem, metadata = reconstructor.process_images(*image_paths)
+        else:
+            dem, metadata = reconstructor.process_block(image_paths, matcher=args.matcher,
+                                                        max_neighbors=args.max_neighbors,
+                                                        tile_size=args.tile_size, workers=args.workers)
         print("DEM generation successful!")
         print(f"DEM shape: {dem.shape}")
         print(f"Metadata: {metadata}")
@@ -214,4 +259,4 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,98 @@
+# Save as ply_stream.py
+import numpy as np
+from pathlib import Path
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8"
+}
+
+def read_ply_header(path: Path) -> Dict:
+    """Parse a PLY header without touching the data.
+
+    Returns the format, header length in bytes and, per element in file
+    order, its name, count and property list (None for list properties).
+    """
+    elements: List[Dict] = []
+    fmt = None
+    with open(str(path), "rb") as f:
+        if f.readline().strip() != b"ply":
+            raise ValueError(f"Not a PLY file: {path}")
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"Unterminated PLY header: {path}")
+            tokens = line.decode("ascii").split()
+            if not tokens or tokens[0] in ("comment", "obj_info"):
+                continue
+            if tokens[0] == "end_header":
+                break
+            if tokens[0] == "format":
+                fmt = tokens[1]
+            elif tokens[0] == "element":
+                elements.append({"name": tokens[1], "count": int(tokens[2]), "properties": []})
+            elif tokens[0] == "property":
+                if tokens[1] == "list":
+                    elements[-1]["properties"] = None
+                elif elements[-1]["properties"] is not None:
+                    elements[-1]["properties"].append((tokens[2], PLY_TYPES[tokens[1]]))
+        header_length = f.tell()
+
+    return {"format": fmt, "header_length": header_length, "elements": elements}
+
+def _vertex_layout(header: Dict) -> Tuple[np.dtype, int, int]:
+    """Structured dtype, byte offset and count of the vertex block."""
+    if header["format"] not in ("binary_little_endian", "binary_big_endian"):
+        raise ValueError(f"Streaming needs a binary PLY, got {header['format']}")
+    byte_order = "<" if header["format"] == "binary_little_endian" else ">"
+
+    offset = header["header_length"]
+    for element in header["elements"]:
+        if element["properties"] is None:
+            raise ValueError(f"Element '{element['name']}' has list properties and cannot be skipped")
+        dtype = np.dtype([(name, byte_order + code) for name, code in element["properties"]])
+        if element["name"] == "vertex":
+            return dtype, offset, element["count"]
+        offset += dtype.itemsize * element["count"]
+    raise ValueError("PLY file has no vertex element")
+
+def open_vertices(path: Path) -> np.memmap:
+    """Memory-map the vertex block of a binary PLY as a structured array."""
+    dtype, offset, count = _vertex_layout(read_ply_header(path))
+    return np.memmap(str(path), dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+def iter_ply_chunks(path: Path, chunk_size: int = 1_000_000,
+                    fields: Sequence[str] = ("x", "y", "z")) -> Iterator[np.ndarray]:
+    """Yield (n, len(fields)) arrays of at most chunk_size vertices.
+
+    Only one chunk is materialised at a time; the rest of the cloud stays in
+    the page cache behind the memory map.
+    """
+    vertices = open_vertices(path)
+    for start in range(0, len(vertices), chunk_size):
+        block = vertices[start:start + chunk_size]
+        yield np.column_stack([block[name] for name in fields])
+
+def ply_bounds(path: Path, chunk_size: int = 1_000_000) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-axis minimum and maximum of x, y, z in one streaming pass, in the file's dtype."""
+    lower = upper = None
+    for chunk in iter_ply_chunks(path, chunk_size):
+        chunk_lower, chunk_upper = chunk.min(axis=0), chunk.max(axis=0)
+        lower = chunk_lower if lower is None else np.minimum(lower, chunk_lower)
+        upper = chunk_upper if upper is None else np.maximum(upper, chunk_upper)
+    if lower is None:
+        raise ValueError(f"PLY file has no vertices: {path}")
+    return lower, upper
+
+def read_ply_points(path: Path, chunk_size: int = 1_000_000) -> np.ndarray:
+    """Load x, y, z into a single (n, 3) float32 array without an intermediate copy."""
+    vertices = open_vertices(path)
+    points = np.empty((len(vertices), 3), dtype=np.float32)
+    for start in range(0, len(vertices), chunk_size):
+        block = vertices[start:start + chunk_size]
+        for axis, name in enumerate(("x", "y", "z")):
+            points[start:start + len(block), axis] = block[name]
+    return points
@@ -0,0 +1,77 @@
+# Save as point_filter.py
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from scipy.spatial import cKDTree
+
+def mean_neighbor_distances(points: np.ndarray, nb_neighbors: int = 20, chunk_size: int = 200_000,
+                            workers: Optional[int] = None) -> np.ndarray:
+    """Mean distance from every point to its nb_neighbors nearest points (itself included).
+
+    Queries run in chunks across threads (cKDTree releases the GIL), so only
+    workers * chunk_size * nb_neighbors distances exist at any time.
+    """
+    tree = cKDTree(points)
+    k = min(nb_neighbors, len(points))
+    means = np.empty(len(points), dtype=np.float64)
+
+    def query(start):
+        distances, _ = tree.query(points[start:start + chunk_size], k=k)
+        means[start:start + chunk_size] = distances.reshape(-1, k).mean(axis=1)
+
+    starts = range(0, len(points), chunk_size)
+    if workers == 1 or len(starts) == 1:
+        for start in starts:
+            query(start)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(query, starts))
+    return means
+
+def remove_statistical_outliers(points: np.ndarray, nb_neighbors: int = 20, std_ratio: float = 2.0,
+                                chunk_size: int = 200_000, workers: Optional[int] = None) -> np.ndarray:
+    """Drop points whose mean neighbour distance exceeds the cloud's mean by std_ratio deviations.
+
+    Same criterion as Open3D's remove_statistical_outlier, computed with a
+    SciPy KD-tree instead of a copy of the cloud in an Open3D PointCloud.
+    """
+    if len(points) < 2:
+        return points
+    means = mean_neighbor_distances(points, nb_neighbors, chunk_size, workers)
+    threshold = means.mean() + std_ratio * means.std(ddof=1)
+    return points[means <= threshold]
+
+def voxel_downsample(points: np.ndarray, voxel_size: float, chunk_size: int = 1 << 20) -> np.ndarray:
+    """Replace the points in each occupied voxel by their centroid.
+
+    Voxel coordinates are packed into one int64 key per point and grouped
+    with np.unique; centroids are per-axis bincounts. Output is ordered by
+    voxel key and keeps the input dtype.
+    """
+    if len(points) == 0 or voxel_size <= 0:
+        return points
+    origin = points[:, :3].min(axis=0).astype(np.float64) - voxel_size / 2
+    extent = np.floor((points[:, :3].max(axis=0) - origin) / voxel_size).astype(np.int64) + 1
+    if np.prod(extent.astype(float)) >= 2 ** 63:
+        raise ValueError("Voxel grid too fine to pack into 64-bit keys")
+
+    keys = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), chunk_size):
+        cells = np.floor((points[start:start + chunk_size, :3] - origin) / voxel_size).astype(np.int64)
+        keys[start:start + chunk_size] = (cells[:, 2] * extent[1] + cells[:, 1]) * extent[0] + cells[:, 0]
+
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    del keys
+    inverse = inverse.reshape(-1)
+    result = np.empty((len(counts), points.shape[1]), dtype=points.dtype)
+    for axis in range(points.shape[1]):
+        result[:, axis] = np.bincount(inverse, weights=points[:, axis], minlength=len(counts)) / counts
+    return result
+
+def filter_point_cloud(points: np.ndarray, nb_neighbors: int = 20, std_ratio: float = 2.0,
+                       voxel_size: float = 0.0, workers: Optional[int] = None) -> np.ndarray:
+    """Statistical outlier removal followed by optional voxel downsampling."""
+    points = remove_statistical_outliers(points, nb_neighbors, std_ratio, workers=workers)
+    if voxel_size > 0:
+        points = voxel_downsample(points, voxel_size)
+    return points
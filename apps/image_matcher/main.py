@@ -1,3 +1,10 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
 import numpy as np
 import cv2
 import torch
@@ -8,16 +15,15 @@ from PIL import Image
 import matplotlib.pyplot as plt
 
 class CrossPerspectiveMatcher:
-    def __init__(self):
+    def __init__(self, num_threads=None, num_workers=4):
         # Initialize SIFT detector
         self.sift = cv2.SIFT_create()
         
-        # Load pretrained ResNet model for feature extraction
+        # The ResNet model is loaded on first use (see `model`)
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model = models.resnet50(pretrained=True)
-        self.model = nn.Sequential(*list(self.model.children())[:-1])  # Remove classification layer
-        self.model.to(self.device)
-        self.model.eval()
+        self.num_threads = num_threads
+        self.num_workers = num_workers
+        self._model = None
         
         # Define image transforms
         self.transform = transforms.Compose([
@@ -27,25 +33,67 @@ class CrossPerspectiveMatcher:
                                std=[0.229, 0.224, 0.225])
         ])
     
+    @property
+    def model(self):
+        """Pretrained ResNet50 without its classification layer, loaded lazily"""
+        if self._model is None:
+            if self.num_threads and self.device.type == "cpu":
+                torch.set_num_threads(self.num_threads)
+            model = models.resnet50(pretrained=True)
+            model = nn.Sequential(*list(model.children())[:-1])  # Remove classification layer
+            model.to(self.device)
+            model.eval()
+            self._model = model
+        return self._model
+    
+    def _prepare(self, image):
+        """Decode (if given a path) and transform one BGR image into a tensor"""
+        if isinstance(image, (str, Path)):
+            path = image
+            image = cv2.imread(str(path))
+            if image is None:
+                raise ValueError(f"Could not load image: {path}")
+        return self.transform(Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)))
+    
     def extract_deep_features(self, image):
         """Extract deep features using ResNet"""
-        img = self.transform(Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)))
-        img = img.unsqueeze(0).to(self.device)
-        
-        with torch.no_grad():
-            features = self.model(img)
-        
-        return features.cpu().numpy().reshape(-1)
+        return self.extract_deep_features_batch([image])[0]
     
-    def find_sift_correspondences(self, img1, img2):
-        """Find corresponding points using SIFT"""
-        # Convert images to grayscale
-        gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-        gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
-        
-        # Detect keypoints and compute descriptors
-        keypoints1, descriptors1 = self.sift.detectAndCompute(gray1, None)
-        keypoints2, descriptors2 = self.sift.detectAndCompute(gray2, None)
+    def iter_deep_features(self, images, batch_size=32):
+        """Yield one (batch_size, 2048) array per batch of images.
+
+        `images` may be any iterable of BGR arrays or image paths; decoding and
+        transforms run in a thread pool while inference is batched.
+        """
+        images = iter(images)
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            while True:
+                chunk = list(islice(images, batch_size))
+                if not chunk:
+                    break
+                batch = torch.stack(list(executor.map(self._prepare, chunk))).to(self.device)
+                
+                with torch.no_grad():
+                    features = self.model(batch)
+                
+                yield features.cpu().numpy().reshape(len(chunk), -1)
+    
+    def extract_deep_features_batch(self, images, batch_size=32):
+        """Extract deep features for many images at once, one row per image"""
+        batches = list(self.iter_deep_features(images, batch_size))
+        if not batches:
+            return np.zeros((0, 2048), dtype=np.float32)
+        return np.vstack(batches)
+    
+    def detect_sift(self, image):
+        """Detect SIFT keypoints and descriptors on the grayscale image"""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return self.sift.detectAndCompute(gray, None)
+    
+    def match_descriptors(self, descriptors1, descriptors2):
+        """Match SIFT descriptors using FLANN and the ratio test"""
+        if descriptors1 is None or descriptors2 is None or len(descriptors1) < 2 or len(descriptors2) < 2:
+            return []
         
         # Match features using FLANN
         FLANN_INDEX_KDTREE = 1
@@ -57,9 +105,19 @@ class CrossPerspectiveMatcher:
         
         # Apply ratio test
         good_matches = []
-        for m, n in matches:
-            if m.distance < 0.7 * n.distance:
-                good_matches.append(m)
+        for pair in matches:
+            if len(pair) == 2 and pair[0].distance < 0.7 * pair[1].distance:
+                good_matches.append(pair[0])
+        
+        return good_matches
+    
+    def find_sift_correspondences(self, img1, img2):
+        """Find corresponding points using SIFT"""
+        # Detect keypoints and compute descriptors
+        keypoints1, descriptors1 = self.detect_sift(img1)
+        keypoints2, descriptors2 = self.detect_sift(img2)
+        
+        good_matches = self.match_descriptors(descriptors1, descriptors2)
         
         return keypoints1, keypoints2, good_matches
     
@@ -97,7 +155,134 @@ class CrossPerspectiveMatcher:
                                   flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS)
         return match_img
 
-def main():
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+
+def _keypoints_to_array(keypoints):
+    return np.array([(kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave, kp.class_id)
+                     for kp in keypoints], dtype=np.float32).reshape(-1, 7)
+
+def _keypoints_from_array(array):
+    return [cv2.KeyPoint(float(x), float(y), float(size), float(angle), float(response), int(octave), int(class_id))
+            for x, y, size, angle, response, octave, class_id in array]
+
+class CorpusIndex:
+    """On-disk store of ResNet embeddings and SIFT features for an image corpus.
+
+    Layout of store_dir:
+        index.json      image paths with the mtime they were described at
+        embeddings.npy  L2-normalised embeddings, one row per image
+        features/       one .npz of keypoints and descriptors per image
+
+    Queries rank the corpus by cosine similarity and SIFT-verify only the
+    top-k candidates.
+    """
+    
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        self.features_dir = self.store_dir / "features"
+        self.entries = []
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+        
+        if (self.store_dir / "index.json").exists():
+            with open(self.store_dir / "index.json") as f:
+                self.entries = json.load(f)
+            self.embeddings = np.load(self.store_dir / "embeddings.npy")
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def build(self, matcher, image_paths, batch_size=32):
+        """Describe every image once; unchanged images already in the store are reused"""
+        self.features_dir.mkdir(parents=True, exist_ok=True)
+        known = {entry['path']: (entry, row) for row, entry in enumerate(self.entries)}
+        image_paths = [str(Path(image_path).resolve()) for image_path in image_paths]
+        
+        described = {}
+        pending = []
+        for image_path in image_paths:
+            mtime = os.path.getmtime(image_path)
+            cached = known.get(image_path)
+            if cached is not None and cached[0]['mtime'] == mtime:
+                described[image_path] = (cached[0], self.embeddings[cached[1]])
+            else:
+                pending.append((image_path, mtime))
+        
+        with ThreadPoolExecutor(max_workers=matcher.num_workers) as executor:
+            for start in range(0, len(pending), batch_size):
+                chunk = pending[start:start + batch_size]
+                images = list(executor.map(cv2.imread, [path for path, _ in chunk]))
+                readable = []
+                for (path, mtime), image in zip(chunk, images):
+                    if image is None:
+                        print(f"Skipping unreadable image: {path}")
+                    else:
+                        readable.append((path, mtime, image))
+                
+                embeddings = matcher.extract_deep_features_batch([image for _, _, image in readable], batch_size)
+                for (image_path, mtime, image), embedding in zip(readable, embeddings):
+                    keypoints, descriptors = matcher.detect_sift(image)
+                    if descriptors is None:
+                        descriptors = np.zeros((0, 128), dtype=np.float32)
+                    
+                    features_file = hashlib.sha1(image_path.encode()).hexdigest()[:16] + ".npz"
+                    np.savez(self.features_dir / features_file,
+                             keypoints=_keypoints_to_array(keypoints), descriptors=descriptors)
+                    entry = {'path': image_path, 'mtime': mtime, 'features': features_file}
+                    described[image_path] = (entry, embedding / (np.linalg.norm(embedding) + 1e-12))
+        
+        # Keep the store in the caller's order
+        ordered = [described[path] for path in dict.fromkeys(image_paths) if path in described]
+        entries = [entry for entry, _ in ordered]
+        embeddings = [embedding for _, embedding in ordered]
+        
+        self.entries = entries
+        self.embeddings = np.vstack(embeddings).astype(np.float32) if embeddings else np.zeros((0, 0), dtype=np.float32)
+        np.save(self.store_dir / "embeddings.npy", self.embeddings)
+        with open(self.store_dir / "index.json", "w") as f:
+            json.dump(self.entries, f, indent=2)
+    
+    def load_features(self, row):
+        """Keypoints and descriptors stored for corpus image `row`"""
+        data = np.load(self.features_dir / self.entries[row]['features'])
+        return _keypoints_from_array(data['keypoints']), data['descriptors']
+    
+    def nearest(self, embedding, k=10):
+        """Rows and cosine similarities of the k nearest corpus embeddings"""
+        if len(self) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=np.float32)
+        
+        embedding = embedding / (np.linalg.norm(embedding) + 1e-12)
+        similarities = self.embeddings @ embedding.astype(np.float32)
+        k = min(k, len(similarities))
+        rows = np.argpartition(-similarities, k - 1)[:k]
+        rows = rows[np.argsort(-similarities[rows])]
+        return rows, similarities[rows]
+    
+    def query(self, matcher, photo, k=10):
+        """Match one photo against the corpus, best SIFT-verified candidate first"""
+        embedding = matcher.extract_deep_features(photo)
+        keypoints, descriptors = matcher.detect_sift(photo)
+        
+        results = []
+        for row, similarity in zip(*self.nearest(embedding, k)):
+            corpus_keypoints, corpus_descriptors = self.load_features(row)
+            matches = matcher.match_descriptors(corpus_descriptors, descriptors)
+            results.append({
+                'path': self.entries[row]['path'],
+                'similarity_score': float(similarity),
+                'num_matches': len(matches),
+                'keypoints_aerial': corpus_keypoints,
+                'keypoints_street': keypoints,
+                'matches': matches
+            })
+        
+        results.sort(key=lambda result: (result['num_matches'], result['similarity_score']), reverse=True)
+        return results
+
+def _list_images(directory):
+    return sorted(str(p) for p in Path(directory).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+
+def run_pair_example():
     # Example usage
     matcher = CrossPerspectiveMatcher()
     
@@ -122,5 +307,39 @@ def main():
     plt.axis('off')
     plt.show()
 
+def main():
+    parser = argparse.ArgumentParser(description='Match street photos against a corpus of aerial tiles')
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads for CPU inference')
+    parser.add_argument('--batch-size', type=int, default=32, help='Images per embedding forward pass')
+    subparsers = parser.add_subparsers(dest='command')
+    
+    index_parser = subparsers.add_parser('index', help='Describe a directory of images into a store')
+    index_parser.add_argument('image_dir', type=str, help='Directory of aerial tiles and/or street photos')
+    index_parser.add_argument('--store', type=str, default='matcher_store', help='Store directory')
+    
+    query_parser = subparsers.add_parser('query', help='Match one photo against an indexed store')
+    query_parser.add_argument('photo', type=str, help='Street photo to match')
+    query_parser.add_argument('--store', type=str, default='matcher_store', help='Store directory')
+    query_parser.add_argument('--top-k', type=int, default=10, help='Candidates to SIFT-verify')
+    
+    args = parser.parse_args()
+    
+    if args.command is None:
+        run_pair_example()
+        return
+    
+    matcher = CrossPerspectiveMatcher(num_threads=args.threads)
+    index = CorpusIndex(args.store)
+    
+    if args.command == 'index':
+        index.build(matcher, _list_images(args.image_dir), batch_size=args.batch_size)
+        print(f"Indexed {len(index)} images into {args.store}")
+    else:
+        photo = cv2.imread(args.photo)
+        if photo is None:
+            raise ValueError(f"Could not load image: {args.photo}")
+        for result in index.query(matcher, photo, k=args.top_k):
+            print(f"{result['num_matches']:5d} matches  similarity {result['similarity_score']:.4f}  {result['path']}")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
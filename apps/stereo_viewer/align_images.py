@@ -4,17 +4,120 @@ import tkinter as tk
 from tkinter import ttk, filedialog
 from PIL import Image, ImageTk
 import os
+import argparse
 from pathlib import Path
 import matplotlib.pyplot as plt
 
+def warped_corners(H, left_shape):
+    """Centres of the left image's corner pixels (TL, TR, BR, BL) mapped into the right image by H."""
+    height, width = left_shape[:2]
+    corners = np.float32([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]]).reshape(-1, 1, 2)
+    return cv2.perspectiveTransform(corners, H).reshape(-1, 2)
+
+def corner_crop(corners, right_shape):
+    """Axis-aligned box inside the warped quadrilateral and the right image, in O(1).
+
+    Each side of the box is the innermost of the two corners on that side,
+    which is always inside a convex quadrilateral but not the largest such
+    box when the warp rotates the image. Ends are exclusive.
+    """
+    (tlx, tly), (trx, try_), (brx, bry), (blx, bly) = corners
+    height, width = right_shape[:2]
+    xmin = int(np.ceil(max(tlx, blx, 0)))
+    ymin = int(np.ceil(max(tly, try_, 0)))
+    xmax = int(np.floor(min(trx, brx, width - 1))) + 1
+    ymax = int(np.floor(min(bly, bry, height - 1))) + 1
+    return xmin, ymin, max(xmax, xmin), max(ymax, ymin)
+
+def box_inside(box, corners):
+    """Whether every pixel of the (exclusive-end) box lies inside the convex quadrilateral."""
+    xmin, ymin, xmax, ymax = box
+    if xmax <= xmin or ymax <= ymin:
+        return False
+    contour = corners.reshape(-1, 1, 2).astype(np.float32)
+    return all(
+        cv2.pointPolygonTest(contour, (float(x), float(y)), False) >= 0
+        for x, y in ((xmin, ymin), (xmax - 1, ymin), (xmax - 1, ymax - 1), (xmin, ymax - 1))
+    )
+
+def largest_rectangle(mask):
+    """Largest all-True axis-aligned rectangle of a boolean mask as (x0, y0, x1, y1), exclusive ends.
+
+    Row-by-row histogram method: O(mask size), meant for small masks.
+    """
+    best, best_area = (0, 0, 0, 0), 0
+    heights = np.zeros(mask.shape[1] + 1, dtype=np.int64)
+    for row in range(mask.shape[0]):
+        heights[:-1] = np.where(mask[row], heights[:-1] + 1, 0)
+        stack = []
+        for col, h in enumerate(heights.tolist()):
+            start = col
+            while stack and stack[-1][1] >= h:
+                start, top = stack.pop()
+                area = top * (col - start)
+                if area > best_area:
+                    best_area = area
+                    best = (start, row - top + 1, col, row + 1)
+            stack.append((start, h))
+    return best
+
+def crop_from_homography(H, left_shape, right_shape, mask_size=256):
+    """Crop (xmin, ymin, xmax, ymax) holding valid data in both the warped left and the right image.
+
+    Works from the homography alone, so no warped pixels are inspected:
+    the warped left outline is rasterised into a mask of at most
+    mask_size cells per side and searched for its largest inscribed
+    rectangle. That rectangle is shrunk by a full cell on each side when
+    scaled back up and kept only if its corners lie inside the exact
+    quadrilateral; the O(1) corner_crop is used when it is larger.
+    """
+    height, width = right_shape[:2]
+    corners = warped_corners(H, left_shape)
+    analytic = corner_crop(corners, right_shape)
+    
+    scale = min(1.0, mask_size / max(height, width))
+    mask_shape = (max(1, int(np.ceil(height * scale))), max(1, int(np.ceil(width * scale))))
+    mask = np.zeros(mask_shape, dtype=np.uint8)
+    cv2.fillConvexPoly(mask, np.round(corners * scale * 16).astype(np.int32), 1, shift=4)
+    
+    # Cell c covers pixels [c / scale, (c + 1) / scale); drop the outer cells entirely
+    x0, y0, x1, y1 = largest_rectangle(mask.astype(bool))
+    searched = (int(np.ceil((x0 + 1) / scale)), int(np.ceil((y0 + 1) / scale)),
+                min(int(np.floor((x1 - 1) / scale)), width), min(int(np.floor((y1 - 1) / scale)), height))
+    
+    area = lambda box: (box[2] - box[0]) * (box[3] - box[1])
+    candidates = [box for box in (analytic, searched) if box_inside(box, corners)]
+    if not candidates:
+        raise ValueError("Aligned images have no common valid region")
+    return max(candidates, key=area)
+
 class StereoImageAligner:
-    def __init__(self):
+    def __init__(self, coarse_size=1024, coarse_features=2000, refine_grid=4, refine_patch=256,
+                 refine_band=32, patch_features=200):
         self.left_img = None
         self.right_img = None
         self.aligned_left = None
         self.aligned_right = None
+        self.homography = None
         self.sift = cv2.SIFT_create()
         
+        # Coarse-to-fine settings: longest side of the coarse level, the
+        # grid x grid refinement patches of refine_patch pixels, and how far
+        # (full-resolution pixels) a match may land from its prediction.
+        # Both levels keep only the strongest keypoints.
+        self.coarse_sift = cv2.SIFT_create(nfeatures=coarse_features)
+        self.patch_sift = cv2.SIFT_create(nfeatures=patch_features)
+        self.coarse_size = coarse_size
+        self.refine_grid = refine_grid
+        self.refine_patch = refine_patch
+        self.refine_band = refine_band
+        
+        # One FLANN matcher for every match_features call
+        FLANN_INDEX_KDTREE = 1
+        index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
+        search_params = dict(checks=50)
+        self.flann = cv2.FlannBasedMatcher(index_params, search_params)
+        
     def load_images(self, left_path, right_path):
         """Load images in both BGR (for OpenCV) and RGB (for display) formats."""
         self.left_img = cv2.imread(left_path)
@@ -26,37 +129,37 @@ class StereoImageAligner:
         self.left_rgb = cv2.cvtColor(self.left_img, cv2.COLOR_BGR2RGB)
         self.right_rgb = cv2.cvtColor(self.right_img, cv2.COLOR_BGR2RGB)
         
-    def detect_features(self):
-        """Detect SIFT features in both images."""
-        gray_left = cv2.cvtColor(self.left_img, cv2.COLOR_BGR2GRAY)
-        gray_right = cv2.cvtColor(self.right_img, cv2.COLOR_BGR2GRAY)
+    def detect_features(self, gray_left=None, gray_right=None, detector=None):
+        """Detect SIFT features in both images (full resolution unless grayscale images are given)."""
+        detector = detector or self.sift
+        if gray_left is None:
+            gray_left = cv2.cvtColor(self.left_img, cv2.COLOR_BGR2GRAY)
+        if gray_right is None:
+            gray_right = cv2.cvtColor(self.right_img, cv2.COLOR_BGR2GRAY)
         
-        kp_left, desc_left = self.sift.detectAndCompute(gray_left, None)
-        kp_right, desc_right = self.sift.detectAndCompute(gray_right, None)
+        kp_left, desc_left = detector.detectAndCompute(gray_left, None)
+        kp_right, desc_right = detector.detectAndCompute(gray_right, None)
         
         return kp_left, desc_left, kp_right, desc_right
         
     def match_features(self, desc_left, desc_right):
         """Match features between images using FLANN."""
-        FLANN_INDEX_KDTREE = 1
-        index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
-        search_params = dict(checks=50)
-        
-        flann = cv2.FlannBasedMatcher(index_params, search_params)
-        matches = flann.knnMatch(desc_left, desc_right, k=2)
+        if desc_left is None or desc_right is None or len(desc_left) < 2 or len(desc_right) < 2:
+            return []
+        matches = self.flann.knnMatch(desc_left, desc_right, k=2)
         
         # Apply ratio test
         good_matches = []
-        for m, n in matches:
-            if m.distance < 0.7 * n.distance:
-                good_matches.append(m)
+        for pair in matches:
+            if len(pair) == 2 and pair[0].distance < 0.7 * pair[1].distance:
+                good_matches.append(pair[0])
                 
         return good_matches
         
-    def align_images(self):
-        """Align images using feature matching and homography."""
+    def estimate_homography(self, gray_left=None, gray_right=None, threshold=5.0, detector=None):
+        """Homography mapping left onto right from SIFT matches of the given (or full) images."""
         # Detect features
-        kp_left, desc_left, kp_right, desc_right = self.detect_features()
+        kp_left, desc_left, kp_right, desc_right = self.detect_features(gray_left, gray_right, detector)
         
         # Match features
         good_matches = self.match_features(desc_left, desc_right)
@@ -69,7 +172,95 @@ class StereoImageAligner:
         dst_pts = np.float32([kp_right[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
         
         # Calculate homography
-        H, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+        H, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, threshold)
+        if H is None:
+            raise ValueError("Could not estimate a homography")
+        return H
+        
+    def _downscale(self, gray):
+        """Grayscale image shrunk so its longest side is at most coarse_size, and the scale used."""
+        scale = min(1.0, self.coarse_size / max(gray.shape[:2]))
+        if scale == 1.0:
+            return gray, scale
+        size = (max(1, round(gray.shape[1] * scale)), max(1, round(gray.shape[0] * scale)))
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA), scale
+        
+    def refine_homography(self, H, gray_left, gray_right):
+        """Refine a full-resolution homography with features from small patches only.
+
+        A refine_grid x refine_grid set of refine_patch-sized patches is cut
+        from the left image, each paired with the patch around its predicted
+        position in the right image (grown by refine_band). SIFT runs on the
+        patches alone and matches are kept only if they land within
+        refine_band pixels of where H puts them. Returns H unchanged when the
+        patches give too few matches.
+        """
+        height, width = gray_left.shape
+        right_height, right_width = gray_right.shape
+        half, band = self.refine_patch // 2, self.refine_band
+        
+        # Patch centres spread over the left image, kept only if they map into the right one
+        ys = np.linspace(half, height - half, self.refine_grid)
+        xs = np.linspace(half, width - half, self.refine_grid)
+        centres = np.float32([[x, y] for y in ys for x in xs]).reshape(-1, 1, 2)
+        predicted = cv2.perspectiveTransform(centres, H).reshape(-1, 2)
+        
+        src_pts, dst_pts = [], []
+        for (cx, cy), (px, py) in zip(centres.reshape(-1, 2), predicted):
+            if not (0 <= px < right_width and 0 <= py < right_height):
+                continue
+            lx0, ly0 = int(max(cx - half, 0)), int(max(cy - half, 0))
+            rx0, ry0 = int(max(px - half - band, 0)), int(max(py - half - band, 0))
+            left_patch = gray_left[ly0:int(cy + half), lx0:int(cx + half)]
+            right_patch = gray_right[ry0:int(py + half + band), rx0:int(px + half + band)]
+            
+            kp_left, desc_left, kp_right, desc_right = self.detect_features(left_patch, right_patch, self.patch_sift)
+            matches = self.match_features(desc_left, desc_right)
+            if not matches:
+                continue
+            
+            src = np.float32([kp_left[m.queryIdx].pt for m in matches]) + (lx0, ly0)
+            dst = np.float32([kp_right[m.trainIdx].pt for m in matches]) + (rx0, ry0)
+            
+            # Keep matches inside the band around the predicted correspondence
+            expected = cv2.perspectiveTransform(src.reshape(-1, 1, 2), H).reshape(-1, 2)
+            near = np.linalg.norm(dst - expected, axis=1) <= band
+            src_pts.append(src[near])
+            dst_pts.append(dst[near])
+        
+        if not src_pts or sum(len(p) for p in src_pts) < 12:
+            return H
+        refined, _ = cv2.findHomography(np.concatenate(src_pts).reshape(-1, 1, 2),
+                                        np.concatenate(dst_pts).reshape(-1, 1, 2), cv2.RANSAC, 3.0)
+        return H if refined is None else refined
+        
+    def estimate_homography_coarse_to_fine(self):
+        """Homography from a downscaled pyramid level, refined at full resolution around its predictions."""
+        gray_left = cv2.cvtColor(self.left_img, cv2.COLOR_BGR2GRAY)
+        gray_right = cv2.cvtColor(self.right_img, cv2.COLOR_BGR2GRAY)
+        
+        small_left, scale_left = self._downscale(gray_left)
+        small_right, scale_right = self._downscale(gray_right)
+        H_coarse = self.estimate_homography(small_left, small_right, detector=self.coarse_sift)
+        
+        # Lift to full resolution: scale left points down, apply H, scale back up
+        H = np.diag([1 / scale_right, 1 / scale_right, 1.0]) @ H_coarse @ np.diag([scale_left, scale_left, 1.0])
+        if scale_left == 1.0 and scale_right == 1.0:
+            return H
+        return self.refine_homography(H / H[2, 2], gray_left, gray_right)
+        
+    def align_images(self, coarse_to_fine=False):
+        """Align images using feature matching and homography.
+
+        With coarse_to_fine the homography comes from
+        estimate_homography_coarse_to_fine instead of SIFT on both
+        full-resolution scans, which is much faster on high-dpi scans.
+        """
+        if coarse_to_fine:
+            H = self.estimate_homography_coarse_to_fine()
+        else:
+            H = self.estimate_homography()
+        self.homography = H
         
         # Warp left image to align with right image
         height, width = self.right_img.shape[:2]
@@ -82,27 +273,11 @@ class StereoImageAligner:
         
     def find_optimal_crop(self):
         """Find the optimal crop region that contains valid image data in both images."""
-        # Create masks for valid (non-black) regions
-        gray_left = cv2.cvtColor(self.aligned_left, cv2.COLOR_BGR2GRAY)
-        gray_right = cv2.cvtColor(self.aligned_right, cv2.COLOR_BGR2GRAY)
-        
-        mask_left = gray_left > 0
-        mask_right = gray_right > 0
-        
-        # Find common valid region
-        common_mask = mask_left & mask_right
-        
-        # Find bounding box of common region
-        rows = np.any(common_mask, axis=1)
-        cols = np.any(common_mask, axis=0)
-        ymin, ymax = np.where(rows)[0][[0, -1]]
-        xmin, xmax = np.where(cols)[0][[0, -1]]
-        
-        return (xmin, ymin, xmax, ymax)
+        return crop_from_homography(self.homography, self.left_img.shape, self.right_img.shape)
         
-    def crop_aligned_images(self):
-        """Crop both images to the optimal region."""
-        xmin, ymin, xmax, ymax = self.find_optimal_crop()
+    def crop_aligned_images(self, crop=None):
+        """Crop both images to the optimal region (or to a precomputed crop box)."""
+        xmin, ymin, xmax, ymax = crop or self.find_optimal_crop()
         
         self.aligned_left = self.aligned_left[ymin:ymax, xmin:xmax]
         self.aligned_right = self.aligned_right[ymin:ymax, xmin:xmax]
@@ -116,6 +291,25 @@ class StereoImageAligner:
         cv2.imwrite(left_output_path, self.aligned_left)
         cv2.imwrite(right_output_path, self.aligned_right)
 
+def align_pairs(pairs, output_dir, coarse_to_fine=True):
+    """Align and crop many (left, right) scan pairs with one aligner, saving <stem>_aligned.png files.
+
+    Returns the crop box used for each pair.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    aligner = StereoImageAligner()
+    crops = []
+    for left_path, right_path in pairs:
+        aligner.load_images(str(left_path), str(right_path))
+        aligner.align_images(coarse_to_fine=coarse_to_fine)
+        crops.append(aligner.find_optimal_crop())
+        aligner.crop_aligned_images(crops[-1])
+        aligner.save_aligned_images(str(output_dir / f"{Path(left_path).stem}_aligned.png"),
+                                    str(output_dir / f"{Path(right_path).stem}_aligned.png"))
+        print(f"{Path(left_path).name} + {Path(right_path).name}: crop {crops[-1]}")
+    return crops
+
 class AlignerGUI:
     def __init__(self, root):
         self.root = root
@@ -175,7 +369,7 @@ class AlignerGUI:
             
             # Load and align images
             self.aligner.load_images(self.left_path, self.right_path)
-            self.aligner.align_images()
+            self.aligner.align_images(coarse_to_fine=True)
             self.aligner.crop_aligned_images()
             
             self.status_var.set("Images aligned successfully")
@@ -248,7 +442,24 @@ class AlignerGUI:
         except Exception as e:
             self.status_var.set(f"Error updating preview: {str(e)}")
 
-if __name__ == "__main__":
+def main():
+    parser = argparse.ArgumentParser(description="Align stereo scan pairs; without images, opens the GUI.")
+    parser.add_argument("images", nargs="*", help="left and right images, as consecutive pairs")
+    parser.add_argument("--output-dir", default="aligned")
+    parser.add_argument("--full-resolution", action="store_true",
+                        help="estimate the homography with full-resolution SIFT instead of coarse-to-fine")
+    args = parser.parse_args()
+    
+    if args.images:
+        if len(args.images) % 2:
+            parser.error("images must come in left/right pairs")
+        pairs = list(zip(args.images[0::2], args.images[1::2]))
+        align_pairs(pairs, args.output_dir, coarse_to_fine=not args.full_resolution)
+        return
+    
     root = tk.Tk()
     app = AlignerGUI(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
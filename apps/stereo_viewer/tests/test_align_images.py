@@ -0,0 +1,43 @@
+# tests/test_align_images.py
+import unittest
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from align_images import crop_from_homography
+
+
+class TestCropFromHomography(unittest.TestCase):
+    def random_homography(self, rng, width, height):
+        """Near-identity homography: small rotation, shift, scale and perspective"""
+        angle = np.deg2rad(rng.uniform(-3, 3))
+        scale = rng.uniform(0.97, 1.03)
+        H = np.array([
+            [scale * np.cos(angle), -scale * np.sin(angle), rng.uniform(-0.03, 0.03) * width],
+            [scale * np.sin(angle), scale * np.cos(angle), rng.uniform(-0.03, 0.03) * height],
+            [rng.uniform(-2e-5, 2e-5), rng.uniform(-2e-5, 2e-5), 1.0]
+        ])
+        return H
+
+    def test_crop_contains_no_black_pixels(self):
+        """The crop never reaches past the warped left image's outline"""
+        rng = np.random.default_rng(0)
+        height, width = 600, 1000
+        left = np.full((height, width), 255, dtype=np.uint8)
+        for _ in range(200):
+            H = self.random_homography(rng, width, height)
+            xmin, ymin, xmax, ymax = crop_from_homography(H, left.shape, left.shape)
+            warped = cv2.warpPerspective(left, H, (width, height))
+            crop = warped[ymin:ymax, xmin:xmax]
+            self.assertGreater(crop.size, 0)
+            self.assertTrue((crop > 0).all(), f"black pixels in crop for H={H.tolist()}")
+
+    def test_identity_keeps_whole_image(self):
+        self.assertEqual(crop_from_homography(np.eye(3), (600, 1000, 3), (600, 1000, 3)), (0, 0, 1000, 600))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,247 @@
+import argparse
+import base64
+import os
+import queue
+import threading
 import tkinter as tk
 from tkinter import filedialog
 import cv2
+import numpy as np
 from inference import get_model
 from inference.core.utils.image_utils import load_image_bgr
 import supervision as sv
 
+class StabilizationEngine:
+    """Keyframe detection plus optical-flow tracking of a reference object.
+
+    The detection model only runs every `keyframe_interval` frames (or when
+    fewer than half of the keyframe's points are still tracked); in between,
+    the reference centre is moved by the median Lucas-Kanade flow of corners
+    inside the reference box, or by phase correlation of the box when it has
+    fewer than `min_tracked_points` corners. The trajectory is smoothed and
+    the video is rendered offline through a decode -> warp -> encode thread
+    pipeline.
+    """
+
+    def __init__(self, model, keyframe_interval=30, smoothing_radius=15,
+                 max_corners=200, min_tracked_points=10, queue_size=32):
+        self.model = model
+        self.keyframe_interval = keyframe_interval
+        self.smoothing_radius = smoothing_radius
+        self.max_corners = max_corners
+        self.min_tracked_points = min_tracked_points
+        self.queue_size = queue_size
+
+    def detect_reference(self, frame, class_id=None):
+        """Return (box, class_id) of the most confident detection, or (None, class_id)"""
+        image = load_image_bgr(frame)
+        results = self.model.infer(image)[0]
+        detections = sv.Detections.from_inference(results)
+        if class_id is not None and len(detections) > 0:
+            detections = detections[detections.class_id == class_id]
+        if len(detections) == 0:
+            return None, class_id
+
+        best = int(np.argmax(detections.confidence))
+        return detections.xyxy[best], int(detections.class_id[best])
+
+    def _corners_in_box(self, gray, box):
+        mask = np.zeros_like(gray)
+        x1, y1, x2, y2 = [int(v) for v in box]
+        mask[max(y1, 0):max(y2, 0), max(x1, 0):max(x2, 0)] = 255
+        return cv2.goodFeaturesToTrack(gray, maxCorners=self.max_corners, qualityLevel=0.01,
+                                       minDistance=7, mask=mask)
+
+    @staticmethod
+    def _phase_shift(prev_gray, gray, center, box_size):
+        """Shift between two frames of a window twice the box size around center, by phase correlation"""
+        half_w, half_h = box_size
+        x1, y1 = max(int(center[0] - half_w), 0), max(int(center[1] - half_h), 0)
+        x2 = min(int(center[0] + half_w), gray.shape[1])
+        y2 = min(int(center[1] + half_h), gray.shape[0])
+        if x2 - x1 < 8 or y2 - y1 < 8:
+            return np.zeros(2)
+        window = cv2.createHanningWindow((x2 - x1, y2 - y1), cv2.CV_32F)
+        (dx, dy), _ = cv2.phaseCorrelate(np.float32(prev_gray[y1:y2, x1:x2]),
+                                         np.float32(gray[y1:y2, x1:x2]), window)
+        return np.array([dx, dy])
+
+    def analyze(self, video_path):
+        """Track the reference centre through the video; returns an (n_frames, 2) array"""
+        cap = cv2.VideoCapture(video_path)
+        trajectory = []
+        class_id = None
+        center = None
+        points = None
+        seeded = 0
+        box_size = None
+        prev_gray = None
+        since_keyframe = 0
+
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+            # Follow the reference between keyframes with sparse optical flow
+            if points is not None and prev_gray is not None:
+                new_points, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None)
+                good = status.reshape(-1) == 1
+                if good.any():
+                    center = center + np.median((new_points - points).reshape(-1, 2)[good], axis=0)
+                points = new_points[good].reshape(-1, 1, 2)
+                if len(points) == 0:
+                    # Every point lost (e.g. a black frame): hold the centre, re-detect below
+                    points = None
+            elif box_size is not None and prev_gray is not None:
+                # Too few corners in the box for LK: follow it by phase correlation
+                center = center + self._phase_shift(prev_gray, gray, center, box_size)
+
+            # Lost when fewer than half of the points seeded at the keyframe survive
+            lost = seeded > 0 and (points is None or len(points) < seeded / 2)
+            if since_keyframe % self.keyframe_interval == 0 or lost:
+                box, class_id = self.detect_reference(frame, class_id)
+                points, seeded, box_size = None, 0, None
+                if box is not None:
+                    center = np.array([(box[0] + box[2]) / 2, (box[1] + box[3]) / 2])
+                    corners = self._corners_in_box(gray, box)
+                    if corners is not None and len(corners) >= self.min_tracked_points:
+                        points, seeded = corners, len(corners)
+                    else:
+                        box_size = (box[2] - box[0], box[3] - box[1])
+                # Without a detection the centre is held until the next scheduled keyframe
+                since_keyframe = 0
+
+            if center is None:
+                # Nothing found yet: treat the frame centre as the reference
+                center = np.array([frame.shape[1] / 2, frame.shape[0] / 2])
+            trajectory.append(center.copy())
+            prev_gray = gray
+            since_keyframe += 1
+
+        cap.release()
+        return np.array(trajectory, dtype=np.float64).reshape(-1, 2)
+
+    def smooth(self, trajectory):
+        """Moving-average smoothing of the trajectory with edge padding"""
+        if self.smoothing_radius <= 0 or len(trajectory) == 0:
+            return trajectory.copy()
+        window = 2 * self.smoothing_radius + 1
+        kernel = np.ones(window) / window
+        padded = np.pad(trajectory, ((self.smoothing_radius, self.smoothing_radius), (0, 0)), mode='edge')
+        return np.column_stack([np.convolve(padded[:, i], kernel, mode='valid') for i in range(2)])
+
+    def corrections(self, trajectory):
+        """Per-frame (dx, dy) shifts that move the reference onto its smoothed path"""
+        return self.smooth(trajectory) - trajectory
+
+    def render(self, video_path, output_path, corrections, preview_callback=None,
+               preview_every=25, preview_width=640):
+        """Write the stabilized video through decode -> warp -> encode threads.
+
+        Bounded queues between the stages keep at most `queue_size` frames in
+        flight each, whatever the length of the video. If given,
+        `preview_callback(frame_index, frame)` receives every `preview_every`-th
+        frame downscaled to `preview_width`; it runs on the encode thread and
+        must not block. An error in any stage stops the pipeline, releases the
+        capture and writer, and is raised here.
+        """
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise IOError(f"Could not open video {video_path}")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        if not writer.isOpened():
+            cap.release()
+            raise IOError(f"Could not open {output_path} for writing")
+
+        decoded = queue.Queue(maxsize=self.queue_size)
+        warped = queue.Queue(maxsize=self.queue_size)
+        done = object()
+        stop = threading.Event()
+        errors = []
+
+        def put(target, item):
+            # Give up once the encoder has stopped, so a full queue never blocks forever
+            while not stop.is_set():
+                try:
+                    target.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(source):
+            while not stop.is_set():
+                try:
+                    return source.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return done
+
+        def decode():
+            try:
+                while not stop.is_set():
+                    ret, frame = cap.read()
+                    if not ret or not put(decoded, frame):
+                        break
+            except Exception as e:
+                errors.append(e)
+            finally:
+                put(decoded, done)
+
+        def warp():
+            index = 0
+            try:
+                while True:
+                    frame = get(decoded)
+                    if frame is done:
+                        break
+                    dx, dy = corrections[min(index, len(corrections) - 1)] if len(corrections) else (0.0, 0.0)
+                    matrix = np.float32([[1, 0, dx], [0, 1, dy]])
+                    if not put(warped, cv2.warpAffine(frame, matrix, (width, height))):
+                        break
+                    index += 1
+            except Exception as e:
+                errors.append(e)
+            finally:
+                put(warped, done)
+
+        threads = [threading.Thread(target=decode, daemon=True), threading.Thread(target=warp, daemon=True)]
+        for thread in threads:
+            thread.start()
+
+        frames_written = 0
+        try:
+            while True:
+                frame = warped.get()
+                if frame is done:
+                    break
+                writer.write(frame)
+                if preview_callback is not None and frames_written % preview_every == 0:
+                    scale = min(1.0, preview_width / width)
+                    preview_callback(frames_written, cv2.resize(frame, None, fx=scale, fy=scale,
+                                                                interpolation=cv2.INTER_AREA))
+                frames_written += 1
+        finally:
+            # Unblock the decode and warp threads if the loop above raised
+            stop.set()
+            for thread in threads:
+                thread.join()
+            cap.release()
+            writer.release()
+        if errors:
+            raise errors[0]
+        return frames_written
+
+    def stabilize(self, video_path, output_path, **render_kwargs):
+        """Analyze, smooth and render in one call; returns the number of frames written"""
+        trajectory = self.analyze(video_path)
+        return self.render(video_path, output_path, self.corrections(trajectory), **render_kwargs)
+
 class VideoStabilizer:
     def __init__(self, master):
         self.master = master
@@ -25,55 +262,101 @@ class VideoStabilizer:
         # Initialize the video and ML model
         self.video = None
         self.model = get_model(model_id="yolov8n-640")
+        self.engine = StabilizationEngine(self.model)
+
+        # Latest preview frame from the render thread; a newer one replaces any still queued
+        self.previews = queue.Queue(maxsize=1)
+        self.worker = None
+        self.failed = False
 
     def select_video(self):
         # Open a file dialog to select the video
         self.video_path = filedialog.askopenfilename(filetypes=[("Video files", "*.mp4;*.avi;*.mov")])
-        if self.video_path:
-            self.video = cv2.VideoCapture(self.video_path)
+        if self.video_path and self.worker is None:
             self.stabilize_video()
 
     def stabilize_video(self):
-        # Get the first frame and process it with the ML model
-        ret, frame = self.video.read()
-        image = load_image_bgr(frame)
-        results = self.model.infer(image)[0]
-        results = sv.Detections.from_inference(results)
+        # Render in the background so the GUI only repaints throttled previews
+        output_path = os.path.splitext(self.video_path)[0] + "_stabilized.mp4"
+        self.select_button.config(state=tk.DISABLED)
 
-        # Find the largest object (likely the reference point)
-        if len(results) > 0:
-            reference_box = max(results, key=lambda x: x.confidence)
+        def run():
+            # The poller re-enables the GUI on None, so it is always sent, after any error
+            try:
+                self.engine.stabilize(self.video_path, output_path, preview_callback=self._queue_preview)
+            except Exception as e:
+                self.previews.put(e)
+            finally:
+                self.previews.put(None)
 
-            # Stabilize the video using the reference box
-            while True:
-                ret, frame = self.video.read()
-                if not ret:
-                    break
+        self.worker = threading.Thread(target=run, daemon=True)
+        self.worker.start()
+        self.master.after(100, lambda: self._poll_previews(output_path))
 
-                image = load_image_bgr(frame)
-                results = self.model.infer(image)[0]
-                results = sv.Detections.from_inference(results)
+    def _queue_preview(self, index, frame):
+        # The render thread is the only producer, so after dropping the stale frame the put cannot fail
+        try:
+            self.previews.get_nowait()
+        except queue.Empty:
+            pass
+        self.previews.put_nowait(frame)
 
-                # Find the current position of the reference box
-                for result in results:
-                    if result.class_id == reference_box.class_id and result.confidence > reference_box.confidence:
-                        reference_box = result
-                        break
+    def _poll_previews(self, output_path):
+        try:
+            frame = self.previews.get_nowait()
+        except queue.Empty:
+            self.master.after(100, lambda: self._poll_previews(output_path))
+            return
+
+        if isinstance(frame, Exception):
+            self.canvas.delete("all")
+            self.canvas.create_text(320, 240, text=f"Stabilization failed: {frame}", fill="red", width=600)
+            self.failed = True
+            self.master.after(100, lambda: self._poll_previews(output_path))
+            return
+
+        if frame is None:
+            self.worker = None
+            self.select_button.config(state=tk.NORMAL)
+            if not self.failed:
+                self.canvas.delete("all")
+                self.canvas.create_text(320, 240, text=f"Saved {os.path.basename(output_path)}")
+            self.failed = False
+            return
+
+        ok, png = cv2.imencode(".png", frame)
+        if ok:
+            self.photo = tk.PhotoImage(data=base64.b64encode(png.tobytes()))
+            self.canvas.delete("all")
+            self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo)
+        self.master.after(100, lambda: self._poll_previews(output_path))
 
-                # Calculate the offset and apply it to the frame
-                offset_x = reference_box.x - image.shape[1] // 2
-                offset_y = reference_box.y - image.shape[0] // 2
-                stabilized_frame = cv2.warpAffine(frame, np.float32([[1, 0, -offset_x], [0, 1, -offset_y]]), (image.shape[1], image.shape[0]))
+def main():
+    parser = argparse.ArgumentParser(description='Stabilize videos around a detected reference object')
+    parser.add_argument('videos', nargs='*', help='Videos to stabilize headlessly; opens the GUI if omitted')
+    parser.add_argument('--output-dir', type=str, default=None, help='Output directory (default: next to each input)')
+    parser.add_argument('--keyframe-interval', type=int, default=30, help='Frames between detection runs')
+    parser.add_argument('--smoothing-radius', type=int, default=15, help='Trajectory smoothing radius in frames')
+    parser.add_argument('--queue-size', type=int, default=32, help='Frames buffered between pipeline stages')
+    args = parser.parse_args()
 
-                # Display the stabilized frame on the canvas
-                stabilized_image = cv2.cvtColor(stabilized_frame, cv2.COLOR_BGR2RGB)
-                self.photo = tk.PhotoImage(width=640, height=480)
-                self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo)
-                self.photo.put(stabilized_image.tobytes(), to=(0, 0))
-                self.canvas.update()
+    if not args.videos:
+        root = tk.Tk()
+        app = VideoStabilizer(root)
+        root.mainloop()
+        return
 
-        self.video.release()
+    engine = StabilizationEngine(get_model(model_id="yolov8n-640"),
+                                 keyframe_interval=args.keyframe_interval,
+                                 smoothing_radius=args.smoothing_radius,
+                                 queue_size=args.queue_size)
+    for video_path in args.videos:
+        stem = os.path.splitext(os.path.basename(video_path))[0]
+        output_dir = args.output_dir or os.path.dirname(os.path.abspath(video_path))
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, f"{stem}_stabilized.mp4")
+        frames = engine.stabilize(video_path, output_path)
+        print(f"{video_path}: wrote {frames} frames to {output_path}")
 
-root = tk.Tk()
-app = VideoStabilizer(root)
-root.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    main()